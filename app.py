@@ -6,22 +6,60 @@ import dash_bootstrap_components as dbc
 import flask
 from flask_caching import Cache
 
+from monopoly.eventlog import EventLogSessionStore
 from monopoly.init import populate_game
+from monopoly.metrics import METRICS
+from monopoly.store import CacheSessionStore, LRUSessionStore, SQLiteSessionStore
 
 server = flask.Flask(__name__)
 server.secret_key = os.environ.get('secret_key', str(randint(0, 1000000)))
 app = dash.Dash(__name__, server=server, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
+# 'sqlite' is shared by all the workers, 'cache' is the original flask-caching filesystem backend
+# 'log' appends each action to a file per session in session_log, fsync-ed every session_sync seconds
+SESSION_STORE = os.environ.get('session_store', 'sqlite')
+SESSION_DB = os.environ.get('session_db', '/tmp/monopoly.db')
+SESSION_LOG = os.environ.get('session_log', '/tmp/monopoly-log')
+SESSION_SYNC = float(os.environ.get('session_sync', 1.0))
+SESSION_MAX_MB = int(os.environ.get('session_max_mb', 256))
+SESSION_TTL = int(os.environ.get('session_ttl', 7 * 24 * 3600))
+
+# the history chart is reduced to about this many points per player: 'lttb', 'minmax' or 'none'
+CHART_MODE = os.environ.get('chart_mode', 'lttb')
+CHART_POINTS = int(os.environ.get('chart_points', 500))
+
+# states before and after the pointer sent to the browser, Backward and Forward within them need no request
+HISTORY_WINDOW = int(os.environ.get('history_window', 20))
+
+# histograms of the callbacks and of the game state on /metrics, for prometheus
+METRICS_ENABLED = os.environ.get('metrics', 'off') == 'on'
+
 CACHE_CONFIG = {
     'CACHE_TYPE': 'filesystem',
     'CACHE_DIR': '/tmp/monopoly',
     'CACHE_THRESHOLD': 10,
 }
 
-cache = Cache()
-cache.init_app(app.server, config=CACHE_CONFIG)
+if SESSION_STORE == 'cache':
+    cache = Cache()
+    cache.init_app(app.server, config=CACHE_CONFIG)
+    shared_store = CacheSessionStore(cache)
+elif SESSION_STORE == 'log':
+    shared_store = EventLogSessionStore(SESSION_LOG, sync_interval=SESSION_SYNC)
+else:
+    shared_store = SQLiteSessionStore(SESSION_DB, max_bytes=SESSION_MAX_MB * 1024 * 1024, ttl=SESSION_TTL)
+
+store = LRUSessionStore(shared_store, size=32)
+
+if METRICS_ENABLED:
+    # before the callbacks are registered, otherwise they are not timed
+    METRICS.enabled = True
+
+    @server.route('/metrics')
+    def metrics():
+        return flask.Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
 
-populate_game(app, cache)
+populate_game(app, store, CHART_MODE, CHART_POINTS, HISTORY_WINDOW)
 
 if __name__ == "__main__":
     app.server.run()
@@ -0,0 +1,223 @@
+// moving in the history happens in the browser, within the window of states sent by draw_state
+// see create_history_window in monopoly/callbacks.py for its content
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    monopoly: {
+        // the fingerprints of the panels on the page, to only replace those which have changed
+        rendered: {},
+        // the event stream of the session and the latest version it has sent
+        live: {session: null, source: null, latest: null, joined: false},
+        // the state the log has last been asked for
+        log: {requested: undefined},
+
+        navigate: function (backward, forward, pointer, history) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (!history || pointer === null || pointer === undefined) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            const triggered = window.dash_clientside.callback_context.triggered.map(t => t.prop_id);
+            const step = triggered.includes('backward-button.n_clicks') ? -1 : 1;
+            // beyond the window the browser waits for the next one
+            const next = Math.max(history.start, Math.min(pointer + step, history.end));
+            if (next === pointer) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            // at the edge of the window, when there is more history, ask for the states around the new pointer
+            const edge = (next === history.start && next > 0) || (next === history.end && next < history.length - 1);
+            return [next, edge ? next : noUpdate];
+        },
+
+        merge_window: function (update, history) {
+            // a whole window, or the states, panels and messages which come after the one the browser has
+            if (!update || (update.append && !history)) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            if (!update.append) {
+                return update;
+            }
+            return Object.assign({}, history, {
+                end: update.end, length: update.length, pointer: update.pointer, reset: update.reset,
+                messages_end: update.messages_end,
+                states: history.states.concat(update.states),
+                panels: Object.assign({}, history.panels, update.panels),
+                messages: history.messages.concat(update.messages)
+            });
+        },
+
+        render: function (history, pointer, shown) {
+            const noUpdate = window.dash_clientside.no_update;
+            if (!history) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            const triggered = window.dash_clientside.callback_context.triggered.map(t => t.prop_id);
+            let current;
+            if (triggered.includes('history-window.data')) {
+                // after an action go to the new pointer, otherwise stay where the browser is
+                current = history.reset || shown === null || shown === undefined ? history.pointer : shown;
+            } else {
+                current = pointer;
+            }
+            current = Math.max(history.start, Math.min(current, history.end));
+
+            const results = [];
+            const state = history.states[current - history.start];
+            history.players.forEach((player, i) => {
+                const fingerprint = state[i];
+                if (this.rendered[player] === fingerprint) {
+                    results.push(noUpdate, noUpdate, noUpdate);
+                    return;
+                }
+                this.rendered[player] = fingerprint;
+
+                const view = history.panels[fingerprint];
+                const rows = view.properties.map(([prop, houses, style]) => html('Tr',
+                    [html('Td', prop), html('Td', houses)], {style: style}));
+                results.push(view.money, view.total, table(rows));
+            });
+
+            const length = history.length;
+            const lower = Math.max(current - history.history, 0);
+            const upper = Math.min(current + history.history, length - 1);
+            const highlight = {'background-color': 'yellow', 'color': 'red'};
+            const rows = [html('Tr', html('Th', 'History'))];
+            for (let i = lower; i <= upper; i++) {
+                const msg = history.messages[i - history.messages_start];
+                rows.push(html('Tr', html('Td', msg, {style: i === current ? highlight : null})));
+            }
+
+            results.push((current + 1) / length * 100, `${current + 1} / ${length}`, table(rows));
+            // the dropdowns follow the state shown, they only need to change with it or after an action
+            results.push(current === shown && !history.reset ? noUpdate : current);
+            return results;
+        },
+
+        follow: function (n, data) {
+            const live = this.live;
+            if (!live.joined) {
+                // a page opened with ?session=... shows that game, from the version the server has
+                live.joined = true;
+                const requested = new URLSearchParams(window.location.search).get('session');
+                if (requested && (!Array.isArray(data) || data[0] !== requested)) {
+                    return [requested, 0];
+                }
+            }
+            if (!Array.isArray(data)) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            if (live.session !== data[0]) {
+                if (live.source) {
+                    live.source.close();
+                }
+                live.session = data[0];
+                live.latest = null;
+                live.source = new EventSource(`/api/games/${encodeURIComponent(data[0])}/events`);
+                live.source.onmessage = (e) => {
+                    live.latest = JSON.parse(e.data).session;
+                };
+                // the address of the page can be opened on another device to follow the game
+                window.history.replaceState(null, '', `?session=${encodeURIComponent(data[0])}`);
+            }
+
+            const latest = live.latest;
+            if (latest && latest[0] === data[0] && latest[1] > data[1]) {
+                return latest;
+            }
+            throw window.dash_clientside.PreventUpdate;
+        },
+
+        log_request: function (data, activeTab, request) {
+            // the server reads the log only while it is shown, and only once for each state
+            const log = this.log;
+            if (activeTab !== 'log-tab' || data === log.requested) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+            log.requested = data;
+            return (request || 0) + 1;
+        },
+
+        request_action: function () {
+            // the request of the button clicked, with the values of the components of its arguments
+            const context = window.dash_clientside.callback_context;
+            const registry = context.states['action-registry.data'];
+            const clicked = context.triggered.find(t => t.value);
+            if (!registry || !clicked) {
+                throw window.dash_clientside.PreventUpdate;
+            }
+
+            const action = registry[clicked.prop_id.split('.')[0]];
+            const request = {action: action.action};
+            Object.entries(action.fields).forEach(([arg, field]) => {
+                request[arg] = context.states[`${field}.value`];
+            });
+            return request;
+        },
+
+        select_trade: function (pointer, seller, prop, history) {
+            const view = getPlayerView(pointer, seller, history);
+            const tradable = view.tradable.find(t => t[0] === prop);
+            return [options(view.tradable), tradable ? tradable[1] : ''];
+        },
+
+        select_mortgage: function (pointer, player, prop, history) {
+            const view = getPlayerView(pointer, player, history);
+            const tradable = view.tradable.find(t => t[0] === prop);
+            const mortgage = tradable ? tradable[2] : false;
+            return [options(view.tradable), mortgage, tradable ? !mortgage : false];
+        },
+
+        select_houses: function (pointer, player, prop, history) {
+            const view = getPlayerView(pointer, player, history);
+            const buildable = view.buildable.find(b => b[0] === prop);
+            return [options(view.buildable), buildable ? buildable[1] === 5 : false,
+                buildable ? buildable[1] === 0 : false];
+        },
+
+        select_rent: function (pointer, player, prop, dice, history) {
+            getPlayerView(pointer, player, history);
+            // the properties of the other players, as they are ranked by price
+            const state = history.states[pointer - history.start];
+            const rent = [];
+            history.players.forEach((other, i) => {
+                if (other !== player && history.humans.includes(other)) {
+                    rent.push(...history.panels[state[i]].rent);
+                }
+            });
+            rent.sort((a, b) => a[1] - b[1]);
+
+            const selected = rent.find(r => r[0] === prop);
+            if (!selected) {
+                return [options(rent), '', '', ''];
+            }
+            const [, , base, perDice, expected, payback] = selected;
+            return [options(rent), base + perDice * dice, expected, payback];
+        }
+    }
+});
+
+function getPlayerView(pointer, player, history) {
+    if (!player || !history || pointer === null || pointer === undefined
+        || pointer < history.start || pointer > history.end) {
+        throw window.dash_clientside.PreventUpdate;
+    }
+    const state = history.states[pointer - history.start];
+    return history.panels[state[history.players.indexOf(player)]];
+}
+
+function options(properties) {
+    return [{label: ''}].concat(properties.map(p => ({label: p[0]})));
+}
+
+function html(type, children, props) {
+    return {type: type, namespace: 'dash_html_components', props: Object.assign({children: children}, props)};
+}
+
+function table(rows) {
+    return {
+        type: 'Table', namespace: 'dash_bootstrap_components',
+        props: {children: html('Tbody', rows), size: 'sm'}
+    };
+}
@@ -0,0 +1,93 @@
+import math
+from typing import Dict, Tuple
+
+import numpy as np
+
+from monopoly import board
+from monopoly.ownership import Ownership
+from monopoly.properties import Properties
+
+
+def get_dice_probabilities() -> np.ndarray:
+    # probability of each total of two dice, indexed by the total
+    probabilities = np.zeros(13)
+    for first in range(1, 7):
+        for second in range(1, 7):
+            probabilities[first + second] += 1 / 36
+    return probabilities
+
+
+def get_transition_matrices() -> Tuple[np.ndarray, np.ndarray]:
+    # probability of ending the turn on each square, starting from each square
+    # and the same weighted by the dice, which is what a utility charges
+    # one roll per turn, go to jail sends the token to jail, chance and community chest are ignored
+    squares = len(board.SQUARES)
+    transitions = np.zeros((squares, squares))
+    dice = np.zeros((squares, squares))
+    for start in range(squares):
+        for total, probability in enumerate(get_dice_probabilities()):
+            if probability:
+                end = (start + total) % squares
+                if end == board.GO_TO_JAIL:
+                    end = board.JAIL
+                transitions[start, end] += probability
+                dice[start, end] += probability * total
+    return transitions, dice
+
+
+def get_stationary_distribution(transitions: np.ndarray) -> np.ndarray:
+    # solve p = p T with sum(p) = 1, replacing one of the (dependent) balance equations
+    squares = len(transitions)
+    equations = transitions.T - np.eye(squares)
+    equations[-1] = 1
+    constants = np.zeros(squares)
+    constants[-1] = 1
+    return np.linalg.solve(equations, constants)
+
+
+class Analytics:
+    # long run value of each property, from how often the tokens end their turn on each square
+    # the board is solved once, rents are computed on demand and kept for each state of the owner
+
+    def __init__(self, definitions: Properties, players: int):
+        self.definitions = definitions
+        self.opponents = players - 1
+
+        transitions, dice = get_transition_matrices()
+        self.landing = get_stationary_distribution(transitions)
+        # landing probability times the dice which got there, for the utilities
+        self.dice = self.landing @ dice
+
+        squares = board.get_square_properties(definitions)
+        self.property_squares: Dict[str, int] = {definitions.names[i]: square
+                                                 for square, i in enumerate(squares) if i >= 0}
+
+        self.cache: Dict[Tuple[str, int, int, bool], Tuple[float, float]] = {}
+
+    def get_expected_rent(self, prop: str, houses: int, owned: int, mortgage: bool = False) -> Tuple[float, float]:
+        # rent expected from each turn of an opponent and rounds needed to recover the price and the houses
+        key = (prop, houses, owned, mortgage)
+        result = self.cache.get(key)
+        if result is None:
+            square = self.property_squares[prop]
+            if mortgage:
+                rent = 0.0
+            elif self.definitions.rules[self.definitions.ids[prop]] == 'Utility':
+                # the rent is linear in the dice
+                rent = float(self.dice[square]) * self.definitions.get_rent(prop, houses, owned, 1)
+            else:
+                rent = float(self.landing[square]) * self.definitions.get_rent(prop, houses, owned, 0)
+
+            cost = self.definitions.prices[self.definitions.ids[prop]] + houses * self.definitions.get_house_price(prop)
+            per_round = rent * self.opponents
+            payback = cost / per_round if per_round > 0 else math.inf
+            result = (rent, payback)
+            self.cache[key] = result
+        return result
+
+    def get_property_expected_rent(self, prop: str, game: Dict, ownership: Ownership) -> Tuple[float, float]:
+        # for the property as it is held by its owner now
+        owner = ownership.get_owner(prop)
+        prop_data = game[owner]['properties'][prop]
+        owned = ownership.get_group_count(owner, self.definitions.colors[self.definitions.ids[prop]])
+        return self.get_expected_rent(prop, prop_data['houses'], owned, prop_data['mortgage'])
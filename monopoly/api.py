@@ -0,0 +1,198 @@
+import json
+import queue
+import time
+from typing import Dict, List
+
+import flask
+
+from monopoly.delta import Touched, copy_game
+from monopoly.game import ROLES, Game
+from monopoly.live import BROADCASTER
+from monopoly.properties import Properties
+from monopoly.store import ConflictError, SessionStore
+from monopoly.update import apply_action
+
+# an event stream is kept open for at most LIVE_SECONDS, with a comment every KEEP_ALIVE_SECONDS when idle
+# it holds one of the threads of its worker meanwhile: with the 16 threads of the Procfile, about 16 followers leave a
+# worker with no thread for the other requests, so add workers (or threads) for more of them
+LIVE_SECONDS = 60
+KEEP_ALIVE_SECONDS = 15
+
+
+def merge_touched(touched: Touched, other: Touched):
+    for player, properties in other.items():
+        touched.setdefault(player, set()).update(properties)
+
+
+def merge_entries(entries: List[Dict]) -> Dict:
+    # the entry of actions recorded as one: what they have in common, and all the money which has changed hands
+    actions = {entry['action'] for entry in entries}
+    properties = {entry['property'] for entry in entries}
+    roles: Dict[str, List[str]] = {role: [] for role in ROLES}
+    for entry in entries:
+        for role, players in roles.items():
+            players += [player for player in entry.get(role, []) if player not in players]
+    return {'action': actions.pop() if len(actions) == 1 else 'batch', **roles,
+            'property': properties.pop() if len(properties) == 1 else None,
+            'amount': sum(entry['amount'] for entry in entries)}
+
+
+def check_game(game: Dict, players: List[str], definitions: Properties):
+    # an imported game must be one of this app: its players with integer money and total, and each property held by
+    # one of them
+    if not isinstance(game, dict) or sorted(game) != sorted(players):
+        raise ValueError(f'Expected a game of {players}')
+    held = set()
+    for player, data in game.items():
+        if not isinstance(data, dict) or any(type(data.get(key)) is not int for key in ('money', 'total')):
+            raise ValueError(f'{player} needs an integer money and total')
+        properties = data.get('properties')
+        if not isinstance(properties, dict):
+            raise ValueError(f'{player} needs properties')
+        for prop, prop_data in properties.items():
+            if prop not in definitions.ids or prop in held:
+                raise ValueError(f'{player} cannot hold {prop}')
+            if not isinstance(prop_data, dict) or type(prop_data.get('mortgage')) is not bool or \
+                    prop_data.get('houses') not in range(6) or type(prop_data['houses']) is not int:
+                raise ValueError(f'{player} has an invalid {prop}')
+            held.add(prop)
+    if len(held) != len(definitions.names):
+        raise ValueError('Some properties are not held by anyone')
+
+
+def api_routes(store: SessionStore, server: flask.Flask, definitions: Properties, human_players: List[str], bank: str):
+
+    @server.route('/api/actions', methods=['POST'])
+    def post_actions():
+        # {"session": [session_id, version] or null for a new game,
+        #  "actions": [{"action": "pay", "pay_player": ..., "receive_player": ..., "pay_amount": ...}, ...],
+        #  "history": "each" (default) or "single" to record them as one entry}
+        # all the actions are applied or none of them, with a single load and store of the session
+        request = flask.request.get_json(force=True, silent=True)
+        if not isinstance(request, dict) or not isinstance(request.get('actions'), list):
+            return flask.jsonify({'error': 'Expected an object with a list of actions'}), 400
+
+        session = request.get('session')
+        if session is not None and not (isinstance(session, list) and len(session) == 2 and
+                                        isinstance(session[0], str) and type(session[1]) is int):
+            return flask.jsonify({'error': 'Expected a session [session_id, version] or null'}), 400
+
+        history = request.get('history', 'each')
+        if history not in ('each', 'single'):
+            return flask.jsonify({'error': f'Unknown history {history}'}), 400
+
+        errors = []
+        messages: List[str] = []
+
+        def change(game_state: Game, stale: bool) -> bool:
+            # each action is added to a copy of the state, so it starts from the totals of the previous one
+            # game_state is only changed if they all succeed
+            scratch = game_state.copy()
+            entries = []
+            for i, action in enumerate(request['actions']):
+                game = copy_game(scratch.get_current_game())
+                ownership = scratch.get_ownership(definitions).copy()
+                try:
+                    result = apply_action(game, ownership, definitions, human_players, bank, action)
+                    if result:
+                        msg, touched, entry = result
+                        scratch.add_state(game, msg, definitions, touched, ownership, entry)
+                except (KeyError, TypeError, ValueError) as e:
+                    errors.append({'error': f'Action {i}: {e!r}', 'index': i})
+                    return False
+                if not result:
+                    errors.append({'error': f'Action {i} has no effect', 'index': i})
+                    return False
+                entries.append((game, msg, touched, ownership, entry))
+
+            # messages is set again by a retry after a conflict
+            if history == 'single' and entries:
+                touched: Dict = {}
+                for _, _, other, _, _ in entries:
+                    merge_touched(touched, other)
+                game, _, _, ownership, _ = entries[-1]
+                msg = '; '.join(msg for _, msg, _, _, _ in entries)
+                game_state.add_state(game, msg, definitions, touched, ownership,
+                                     merge_entries([entry for _, _, _, _, entry in entries]))
+                messages[:] = [msg]
+            else:
+                game_state.state = scratch.state
+                messages[:] = [msg for _, msg, _, _, _ in entries]
+            return bool(entries)
+
+        # on top of the latest state, whichever version the client has
+        try:
+            session = Game.update(store, session, definitions, human_players, bank, change)
+        except ConflictError as e:
+            return flask.jsonify({'error': str(e)}), 409
+        if errors:
+            return flask.jsonify(errors[0]), 400
+        return flask.jsonify({'session': session, 'messages': messages})
+
+    @server.route('/api/games/<session_id>/<int:version>/export')
+    def export_game(session_id: str, version: int):
+        # newline delimited json, written while the history is read: a header, then see Game.get_records
+        game_state = Game.from_cache(store, [session_id, version])
+        if not game_state.state:
+            return flask.jsonify({'error': f'Unknown game {session_id}'}), 404
+
+        def generate():
+            yield json.dumps({'type': 'game', 'players': human_players + [bank]}) + '\n'
+            for record in game_state.get_records():
+                yield json.dumps(record) + '\n'
+
+        return flask.Response(generate(), mimetype='application/x-ndjson')
+
+    @server.route('/api/games/<session_id>/events')
+    def follow_game(session_id: str):
+        # server-sent events with the new versions of the game, as they are saved by this worker
+        # the first one is the version when the stream starts, which ends after LIVE_SECONDS and the browser opens
+        # it again: then it gets what was saved by the other workers
+        state = store.get_latest(session_id)
+        if state is None:
+            return flask.jsonify({'error': f'Unknown game {session_id}'}), 404
+        # subscribed before the response starts, so that nothing saved from now on is lost
+        events = BROADCASTER.subscribe(session_id)
+        first = json.dumps({'session': [session_id, state.get('version', 0)], 'pointer': state['pointer']})
+
+        def generate():
+            try:
+                yield f'data: {first}\n\n'
+                end = time.monotonic() + LIVE_SECONDS
+                while time.monotonic() < end:
+                    try:
+                        yield f'data: {events.get(timeout=KEEP_ALIVE_SECONDS)}\n\n'
+                    except queue.Empty:
+                        yield ': keep-alive\n\n'
+            finally:
+                BROADCASTER.unsubscribe(session_id, events)
+
+        return flask.Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    @server.route('/api/games/import', methods=['POST'])
+    def import_game():
+        # the body is what export_game writes, it is read one line at a time into a new session
+        game_state = Game()
+        game_state.clear()
+        lines = (line for line in flask.request.stream if line.strip())
+        try:
+            header = json.loads(next(lines, b'{}'))
+            if header.get('type') != 'game' or header.get('players') != human_players + [bank]:
+                return flask.jsonify({'error': f'Not a game of {human_players + [bank]}'}), 400
+            for line in lines:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError('Expected a record object')
+                # a snapshot is checked as it is, a delta by the state it leads to
+                if record.get('type') == 'snapshot':
+                    check_game(record.get('game'), human_players + [bank], definitions)
+                game_state.add_record(record)
+                if record['type'] == 'delta':
+                    check_game(game_state.state['current'], human_players + [bank], definitions)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return flask.jsonify({'error': repr(e), 'index': len(game_state.state['messages'])}), 400
+
+        if not game_state.state['messages']:
+            return flask.jsonify({'error': 'The game has no history'}), 400
+        session = game_state.to_cache(store, None)
+        return flask.jsonify({'session': session, 'states': len(game_state.state['messages'])})
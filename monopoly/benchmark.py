@@ -0,0 +1,256 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+import dash
+
+from monopoly.codec import encode
+from monopoly.delta import Touched, copy_game
+from monopoly.eventlog import EventLogSessionStore
+from monopoly.game import Game
+from monopoly.init import populate_game
+from monopoly.ownership import Ownership
+from monopoly.properties import Properties
+from monopoly.store import LRUSessionStore, SQLiteSessionStore, SessionStore
+from monopoly.update import apply_action
+
+# synthetic games played with the functions behind the buttons, each layer is timed separately
+# python -m monopoly.benchmark --output new.json --baseline old.json fails if anything got slower or bigger
+HUMAN_PLAYERS = ['Amsi', 'Ofi', 'Pappo']
+BANK = 'Mafia'
+SIZES = [10, 1000, 10000]
+ACTIONS = ['pay', 'trade', 'go', 'income_tax', 'super_tax', 'out_of_jail', 'mortgage', 'unmortgage', 'buy_house',
+           'sell_house', 'pay_rent']
+
+
+def random_action(game: Dict, ownership: Ownership, definitions: Properties,
+                  rng: random.Random) -> Tuple[str, Optional[Tuple[str, Touched, Dict]]]:
+    # one action with arguments which make sense for the game, None if it cannot be done now
+    name = rng.choice(ACTIONS)
+    player = rng.choice(HUMAN_PLAYERS)
+    owned = {prop: owner for owner in HUMAN_PLAYERS for prop in game[owner]['properties']}
+
+    if name == 'pay':
+        players = HUMAN_PLAYERS + [BANK, 'ALL']
+        request = {'pay_player': rng.choice(players), 'receive_player': rng.choice(players),
+                   'pay_amount': rng.randrange(1, 300)}
+    elif name == 'trade':
+        prop = rng.choice(definitions.names)
+        seller = owned.get(prop, BANK)
+        buyer = rng.choice(HUMAN_PLAYERS + [BANK])
+        request = {'trade_seller': seller, 'trade_buyer': buyer, 'trade_property': prop,
+                   'trade_price': definitions.prices[definitions.ids[prop]]}
+    elif name in ('go', 'income_tax', 'super_tax', 'out_of_jail'):
+        request = {'extra_player': player}
+    elif name in ('mortgage', 'unmortgage'):
+        tradable = [prop for prop, data in definitions.get_tradable_properties(game[player]).items()
+                    if data['mortgage'] == (name == 'unmortgage')]
+        if not tradable:
+            return name, None
+        request = {'mortgage_player': player, 'mortgage_property': rng.choice(tradable)}
+    elif name in ('buy_house', 'sell_house'):
+        buildable = list(definitions.get_buildable_properties(game[player]))
+        if not buildable:
+            return name, None
+        request = {'houses_player': player, 'houses_property': rng.choice(buildable)}
+    else:
+        rent_properties = list(ownership.get_rent_properties(player, HUMAN_PLAYERS))
+        if not rent_properties:
+            return name, None
+        request = {'rent_player': player, 'rent_property': rng.choice(rent_properties),
+                   'rent_dice': rng.randint(2, 12)}
+    return name, apply_action(game, ownership, definitions, HUMAN_PLAYERS, BANK, dict(request, action=name))
+
+
+def play(definitions: Properties, actions: int, seed: int, timings: Optional[Dict[str, List[float]]] = None,
+         counts: Optional[Dict[str, int]] = None) -> Game:
+    # same steps as update_game, without the round trip to the store
+    rng = random.Random(seed)
+    game_state = Game()
+    game_state.initialise(definitions, HUMAN_PLAYERS, BANK)
+    clock = time.perf_counter
+
+    while len(game_state.state['messages']) <= actions:
+        t0 = clock()
+        game = copy_game(game_state.get_current_game())
+        ownership = game_state.get_ownership(definitions).copy()
+        t1 = clock()
+        name, result = random_action(game, ownership, definitions, rng)
+        if not result:
+            continue
+        t2 = clock()
+        msg, touched, entry = result
+        game_state.add_state(game, msg, definitions, touched, ownership, entry)
+        t3 = clock()
+
+        if timings is not None:
+            timings['copy'].append(t1 - t0)
+            timings['action'].append(t2 - t1)
+            timings['add_state'].append(t3 - t2)
+        if counts is not None:
+            counts[name] = counts.get(name, 0) + 1
+    return game_state
+
+
+def measure(function: Callable, repeat: int) -> float:
+    # best of repeat, in milliseconds
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return round(min(times) * 1000, 4)
+
+
+class Renderer:
+    # calls draw_state through the dash server, as the browser does
+
+    def __init__(self, store: SessionStore):
+        app = dash.Dash(__name__)
+        # with the same cache in front of the store as the app
+        populate_game(app, LRUSessionStore(store, size=32))
+        self.client = app.server.test_client()
+        dependencies = json.loads(self.client.get('/_dash-dependencies').data)
+        self.dependency = next(d for d in dependencies if 'history-charts.figure' in d['output'])
+
+    def render(self, data, rendered: Optional[Dict]) -> Tuple[Dict, int]:
+        dependency = self.dependency
+        outputs = [dict(zip(['id', 'property'], o.split('.'))) for o in dependency['output'].strip('.').split('...')]
+        values = {'game-state.data': data, 'render-state.data': rendered}
+        payload = {
+            'output': dependency['output'],
+            'outputs': outputs,
+            'inputs': [dict(i, value=values.get(f"{i['id']}.{i['property']}")) for i in dependency['inputs']],
+            'changedPropIds': ['game-state.data'],
+            'state': [dict(s, value=values.get(f"{s['id']}.{s['property']}")) for s in dependency['state']],
+        }
+        response = self.client.post('/_dash-update-component', json=payload)
+        result = json.loads(response.data)['response']
+        return result['render-state']['data'], len(response.data)
+
+
+def run(definitions: Properties, actions: int, repeat: int, seed: int, folder: str) -> Dict:
+    timings: Dict[str, List[float]] = {'copy': [], 'action': [], 'add_state': []}
+    counts: Dict[str, int] = {}
+    game_state = play(definitions, actions, seed, timings, counts)
+    result = {
+        'actions': len(game_state.state['messages']) - 1,
+        'action_types': dict(sorted(counts.items())),
+    }
+    for layer, values in timings.items():
+        result[f'{layer}_mean_ms'] = round(statistics.mean(values) * 1000, 4)
+
+    # the same game again, for the memory
+    tracemalloc.start()
+    game_state = play(definitions, actions, seed)
+    result['state_memory_bytes'], result['peak_memory_bytes'] = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    data = game_state.to_cache(None, None)
+    result['json_payload_bytes'] = len(data)
+    result['to_cache_json_ms'] = measure(lambda: game_state.to_cache(None, None), repeat)
+    result['from_cache_json_ms'] = measure(lambda: Game.from_cache(None, data), repeat)
+
+    result['encoded_payload_bytes'] = len(encode(game_state.state))
+    store = SQLiteSessionStore(os.path.join(folder, f'{actions}.db'), max_bytes=1 << 30, ttl=3600)
+    data = game_state.to_cache(store, None)
+    result['to_cache_store_ms'] = measure(lambda: game_state.to_cache(store, data), repeat)
+    data = game_state.to_cache(store, data)
+    result['from_cache_store_ms'] = measure(lambda: Game.from_cache(store, data), repeat)
+
+    # after the first snapshot a write only appends the new states, a read replays the log
+    # on a copy, the version of a state follows the store it is saved to
+    log_state = Game.from_cache(store, data)
+    log_store = EventLogSessionStore(os.path.join(folder, f'{actions}-log'), sync_interval=0)
+    log_data = log_state.to_cache(log_store, None)
+    result['to_cache_log_ms'] = measure(lambda: log_state.to_cache(log_store, log_data), repeat)
+    result['from_cache_log_ms'] = measure(lambda: Game.from_cache(log_store, log_data), repeat)
+
+    # the newest page of the log, with a filter (one index) and with two of them (intersected)
+    result['history_page_ms'] = measure(lambda: game_state.get_history({'player': 'Ofi'}, 0, 20), repeat)
+    result['history_filtered_ms'] = measure(
+        lambda: game_state.get_history({'player': 'Ofi', 'action': 'pay_rent'}, 0, 20), repeat)
+
+    # a page load draws everything, an action afterwards only what changed
+    renderer = Renderer(store)
+    result['draw_state_full_ms'] = measure(lambda: renderer.render(data, None), repeat)
+    rendered, result['draw_state_full_bytes'] = renderer.render(data, None)
+
+    rng = random.Random(seed)
+    result['draw_state_action_ms'] = []
+    for _ in range(repeat):
+        while True:
+            game = copy_game(game_state.get_current_game())
+            ownership = game_state.get_ownership(definitions).copy()
+            _, action = random_action(game, ownership, definitions, rng)
+            if action:
+                break
+        msg, touched, entry = action
+        game_state.add_state(game, msg, definitions, touched, ownership, entry)
+        data = game_state.to_cache(store, data)
+        start = time.perf_counter()
+        rendered, size = renderer.render(data, rendered)
+        result['draw_state_action_ms'].append((time.perf_counter() - start) * 1000)
+    result['draw_state_action_ms'] = round(min(result['draw_state_action_ms']), 4)
+    result['draw_state_action_bytes'] = size
+
+    return result
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    # the measures which got worse by more than tolerance
+    regressions = []
+    for size, measures in results['sizes'].items():
+        for name, value in measures.items():
+            old = baseline['sizes'].get(size, {}).get(name)
+            if name.endswith(('_ms', '_bytes')) and old and value > old * (1 + tolerance):
+                regressions.append(f'{size} actions, {name}: {old:.3f} -> {value:.3f}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the game layers on synthetic games')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='json file for the results, default is stdout')
+    parser.add_argument('--baseline', help='json file of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    definitions = Properties()
+    with tempfile.TemporaryDirectory() as folder:
+        results = {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'sizes': {str(size): run(definitions, size, args.repeat, args.seed, folder) for size in args.sizes},
+        }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
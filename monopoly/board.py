@@ -0,0 +1,28 @@
+from typing import List
+
+from monopoly.properties import Properties
+
+# the 40 squares of the board, starting from GO, with the properties named as in properties.csv
+SQUARES = [
+    'GO', 'Old Kent Road', 'Community Chest', 'White Chapel', 'Income Tax',
+    'King’s Cross Station', 'The Angel, Islington', 'Chance', 'Euston', 'Pentonville',
+    'Jail', 'Pall Mall', 'Electric Company', 'Whitehall', 'Northumberland Avenue',
+    'Marylebone Station', 'Bow Street', 'Community Chest', 'Marlborough Street', 'Vine street',
+    'Free Parking', 'Strand', 'Chance', 'Fleet Street', 'Trafalgar Square',
+    'Fenchurch St. Station', 'Leicester Square', 'Coventry Street', 'Water Works', 'Piccadilly',
+    'Go To Jail', 'Regent Street', 'Oxford Street', 'Community Chest', 'Bond Street',
+    'Liverpool St. Station', 'Chance', 'Park Lane', 'Super Tax', 'Mayfair',
+]
+
+GO = 0
+JAIL = SQUARES.index('Jail')
+GO_TO_JAIL = SQUARES.index('Go To Jail')
+INCOME_TAX = SQUARES.index('Income Tax')
+SUPER_TAX = SQUARES.index('Super Tax')
+CHANCE = [i for i, square in enumerate(SQUARES) if square == 'Chance']
+COMMUNITY_CHEST = [i for i, square in enumerate(SQUARES) if square == 'Community Chest']
+
+
+def get_square_properties(definitions: Properties) -> List[int]:
+    # for each square, the id of its property or -1
+    return [definitions.ids.get(square, -1) for square in SQUARES]
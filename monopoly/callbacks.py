@@ -1,25 +1,163 @@
+import json
+import math
+import zlib
 from typing import List, Dict, Optional
 
-import dash_bootstrap_components as dbc
+import dash
 import dash_html_components as html
 import plotly.graph_objs as go
-from dash.dependencies import Input, Output
+from dash import no_update
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from dash.exceptions import PreventUpdate
-from flask_caching import Cache
 from plotly.subplots import make_subplots
 
+from monopoly.analytics import Analytics
+from monopoly.downsample import downsample
 from monopoly.game import Game
-from monopoly.layout import EMPTY_SELECT
+from monopoly.metrics import METRICS
 from monopoly.properties import Properties
+from monopoly.store import SessionStore
 
+# messages shown before and after the current one
+HISTORY_ROWS = 10
+# entries in a page of the log
+LOG_ROWS = 20
 
-def get_options_for_player_properties(properties: Dict, definitions: Properties) -> List[Dict]:
-    sorted_props = definitions.get_sorted_properties(properties)
-    options = EMPTY_SELECT + [{'label': p} for p in sorted_props]
-    return options
 
+def get_zoom_range(relayout: Optional[Dict]) -> Optional[List[int]]:
+    # the range of states shown after the user has zoomed the chart, None for all of them
+    if relayout:
+        if 'xaxis.range[0]' in relayout:
+            return [math.floor(relayout['xaxis.range[0]']), math.ceil(relayout['xaxis.range[1]'])]
+        if 'xaxis.range' in relayout:
+            return [math.floor(relayout['xaxis.range'][0]), math.ceil(relayout['xaxis.range'][1])]
+    return None
 
-def register_callbacks(cache: Optional[Cache], app, definitions: Properties, human_players: List[str], bank: str):
+
+def create_history_figure(game_state: Game, all_players: List[str], bank: str,
+                          chart_mode: str, chart_points: int, zoom: Optional[List[int]]):
+    start, end = (max(zoom[0], 0), max(zoom[1] + 1, 0)) if zoom else (0, None)
+
+    fig = make_subplots(specs=[[{"secondary_y": True}]])
+    # keeps the zoom when the figure is replaced
+    fig.update_layout(uirevision='history')
+    for player in all_players:
+        x, y = downsample(game_state.get_player_value_history(player), chart_mode, chart_points, start, end)
+        if player == bank:
+            fig.add_trace(go.Scatter(x=x, y=y, mode='markers', name=player), secondary_y=True)
+        else:
+            fig.add_trace(go.Scatter(x=x, y=y, mode='markers+lines', name=player))
+    return fig
+
+
+def create_player_view(definitions: Properties, analytics: Analytics, player_data: Dict, human: bool) -> Dict:
+    # everything shown for a player, and the choices offered by the dropdowns which involve the player
+    player_properties = player_data['properties']
+    sorted_props = definitions.get_sorted_properties(player_properties)
+    tradable_properties = definitions.get_tradable_properties(player_data)
+    buildable_properties = definitions.get_buildable_properties(player_data)
+
+    rent = []
+    if human:
+        # the rent is linear in the dice, only utilities depend on it
+        counts = {}
+        for prop in player_properties:
+            color = definitions.colors[definitions.ids[prop]]
+            counts[color] = counts.get(color, 0) + 1
+        for prop in sorted_props:
+            prop_data = player_properties[prop]
+            if not prop_data['mortgage']:
+                houses = prop_data['houses']
+                owned = counts[definitions.colors[definitions.ids[prop]]]
+                base = definitions.get_rent(prop, houses, owned, 0)
+                per_dice = definitions.get_rent(prop, houses, owned, 1) - base
+                expected, payback = analytics.get_expected_rent(prop, houses, owned)
+                rent.append([prop, definitions.ranks[prop], base, per_dice, f'{expected:.2f}',
+                             f'{payback:.1f}' if math.isfinite(payback) else ''])
+
+    return {
+        'money': f"{player_data['money']:,}",
+        'total': f"{player_data['total']:,}",
+        'properties': [[prop, player_properties[prop]['houses'], definitions.get_color_style(prop, player_properties)]
+                       for prop in sorted_props],
+        'tradable': [[prop, definitions.get_property_value(prop, player_data), player_properties[prop]['mortgage']]
+                     for prop in sorted_props if prop in tradable_properties],
+        'buildable': [[prop, player_properties[prop]['houses']]
+                      for prop in sorted_props if prop in buildable_properties],
+        'rent': rent,
+    }
+
+
+def create_history_window(game_state: Game, definitions: Properties, analytics: Analytics, human_players: List[str],
+                          all_players: List[str], pointer: int, width: int, reset: bool,
+                          held: Optional[Dict] = None) -> Dict:
+    # what the browser needs to show the states around the pointer without calling the server
+    # each state refers to the panels of the players, which are only sent once
+    # held is the window the browser has of the same history: when the new one only extends it, what comes after it
+    # is appended to it (see merge_window in assets/monopoly.js)
+    length = len(game_state.state['messages'])
+    pointer = max(0, min(pointer, length - 1))
+    start = max(pointer - width, 0)
+    end = min(pointer + width, length - 1)
+    append = held is not None and held['start'] <= pointer and held['end'] <= end and end - held['start'] <= 2 * width
+    if append:
+        start = held['start']
+        first = held['end']
+    else:
+        first = start
+
+    panels = {}
+    states = []
+    # unchanged players are shared by consecutive games, they only need to be fingerprinted once
+    fingerprints = {}
+    games = game_state.get_games(first, end)
+    for game in games:
+        state = []
+        for player in all_players:
+            player_data = game[player]
+            fingerprint = fingerprints.get(id(player_data))
+            if fingerprint is None:
+                fingerprint = str(zlib.crc32(json.dumps(player_data, sort_keys=True).encode()))
+                fingerprints[id(player_data)] = fingerprint
+            if fingerprint not in panels:
+                panels[fingerprint] = create_player_view(definitions, analytics, player_data, player in human_players)
+            state.append(fingerprint)
+        states.append(state)
+
+    messages_start = max(start - HISTORY_ROWS, 0)
+    messages_end = min(end + HISTORY_ROWS + 1, length)
+    window = {'start': start, 'end': end, 'length': length, 'pointer': pointer, 'reset': reset,
+              'messages_start': messages_start, 'messages_end': messages_end}
+    if append:
+        # the browser already has the last state it holds, and the panels of its players
+        for fingerprint in states[0]:
+            panels.pop(fingerprint, None)
+        messages = game_state.state['messages'][held['messages_end']:messages_end]
+        return dict(window, append=True, states=states[1:], panels=panels, messages=messages)
+
+    messages = game_state.state['messages'][messages_start:messages_end]
+    return dict(window, history=HISTORY_ROWS, players=all_players, humans=human_players, states=states,
+                panels=panels, messages=messages)
+
+
+def get_branch_options(game_state: Game) -> List[Dict]:
+    # by the state they fork from, the value is the position of the branch in the game
+    branches = sorted(enumerate(game_state.get_branches()), key=lambda branch: branch[1][0])
+    return [{'label': ''}] + [{'label': f'After {fork + 1}: {msg} (+{length})', 'value': str(i)}
+                              for i, (fork, msg, length) in branches]
+
+
+def create_log_rows(page: List) -> List:
+    rows = [html.Tr([html.Th('#'), html.Th('Entry'), html.Th('M$')])]
+    for i, msg, entry in page:
+        amount = f"{entry['amount']:,}" if entry and entry['amount'] else ''
+        rows.append(html.Tr([html.Td(i + 1), html.Td(msg), html.Td(amount)]))
+    return [html.Tbody(rows)]
+
+
+def register_callbacks(store: Optional[SessionStore], app, definitions: Properties, analytics: Analytics,
+                       human_players: List[str], bank: str, chart_mode: str, chart_points: int,
+                       history_window: int):
     all_players = human_players + [bank]
     outputs = []
     for player in all_players:
@@ -27,184 +165,215 @@ def register_callbacks(cache: Optional[Cache], app, definitions: Properties, hum
         outputs.append(Output(f'{player}-total', 'value'))
         outputs.append(Output(f'{player}-properties', 'children'))
 
-    @app.callback(
-        outputs + [
-            Output('game-progress', 'value'),
-            Output('game-progress', 'children'),
-            Output('history-table', 'children'),
-            Output('history-charts', 'figure'),
-            Output('json-size', 'children'),
+    # moving in the history and drawing the players happen in the browser, see assets/monopoly.js
+    # the server only sends a window of states around the pointer, and a new one when the browser reaches its edge
+    app.clientside_callback(
+        ClientsideFunction(namespace='monopoly', function_name='navigate'),
+        [
+            Output('history-pointer', 'data'),
+            Output('window-request', 'data'),
         ],
         [
-            Input('game-state', 'data')
+            Input('backward-button', 'n_clicks'),
+            Input('forward-button', 'n_clicks'),
+        ],
+        [
+            State('view-pointer', 'data'),
+            State('history-window', 'data'),
         ]
     )
-    def draw_state(data: str):
-        if not data:
-            raise PreventUpdate
-
-        game_state = Game.from_cache(cache, data)
-        game = game_state.get_current_game()
 
-        fig = make_subplots(specs=[[{"secondary_y": True}]])
-
-        results = []
-        for player in all_players:
-            player_data = game[player]
-            money = player_data['money']
-            results.append(f'{money:,}')
-            total = player_data['total']
-            results.append(f'{total:,}')
-            ts = game_state.get_player_value_history(player)
-            if player == bank:
-                fig.add_trace(go.Scatter(y=ts, mode='markers', name=player), secondary_y=True)
-            else:
-                fig.add_trace(go.Scatter(y=ts, mode='markers+lines', name=player))
-
-            player_properties = player_data['properties']
-            sorted_props = definitions.get_sorted_properties(player_properties)
-
-            rows = [html.Tr([
-                html.Td(prop),
-                html.Td(player_properties[prop]['houses']),
-            ], style=definitions.get_color_style(prop, player_properties)) for prop in sorted_props]
-            table = dbc.Table(html.Tbody(rows), size='sm')
-            results.append(table)
-
-        progress, msg = game_state.get_progress()
-
-        history, pointer = game_state.get_history(10)
-        highlight = {'background-color': 'yellow', 'color': 'red'}
-        rows = [html.Tr(html.Td(msg, style=(highlight if i == pointer else None))) for i, msg in history]
-        rows.insert(0, html.Tr(html.Th('History')))
-        history_table = dbc.Table(html.Tbody(rows), size='sm')
-
-        if cache:
-            json_size = f'Game: {data}'
-        else:
-            json_size = f'Game: {len(data)} bytes'
-
-        return results + [progress * 100, msg, history_table, fig, json_size]
+    app.clientside_callback(
+        ClientsideFunction(namespace='monopoly', function_name='merge_window'),
+        Output('history-window', 'data'),
+        [Input('window-update', 'data')],
+        [State('history-window', 'data')]
+    )
 
-    @app.callback(
+    app.clientside_callback(
+        ClientsideFunction(namespace='monopoly', function_name='render'),
+        outputs + [
+            Output('game-progress', 'value'),
+            Output('game-progress', 'children'),
+            Output('history-table', 'children'),
+            Output('view-pointer', 'data'),
+        ],
         [
-            Output('trade-property', 'options'),
-            Output('trade-price', 'value'),
+            Input('history-window', 'data'),
+            Input('history-pointer', 'data'),
         ],
         [
-            Input('game-state', 'data'),
-            Input('trade-seller', 'value'),
-            Input('trade-property', 'value'),
+            State('view-pointer', 'data'),
         ]
     )
-    def update_trade_property_price(data: str, seller: str, prop: str):
-        if not seller or not data:
-            raise PreventUpdate
-
-        game_state = Game.from_cache(cache, data)
-        game = game_state.get_current_game()
-
-        player_data = game[seller]
-        tradable_properties = definitions.get_tradable_properties(player_data)
-        options = get_options_for_player_properties(tradable_properties, definitions)
 
-        if prop in tradable_properties:
-            price = definitions.get_property_value(prop, player_data)
-        else:
-            price = ''
-
-        return options, price
+    # the dropdowns choose from the state shown, which is already in the window
+    selectors = [
+        ('select_trade', [Output('trade-property', 'options'), Output('trade-price', 'value')],
+         [Input('trade-seller', 'value'), Input('trade-property', 'value')]),
+        ('select_mortgage', [Output('mortgage-property', 'options'), Output('mortgage-button', 'disabled'),
+                             Output('unmortgage-button', 'disabled')],
+         [Input('mortgage-player', 'value'), Input('mortgage-property', 'value')]),
+        ('select_houses', [Output('houses-property', 'options'), Output('buy-house-button', 'disabled'),
+                           Output('sell-house-button', 'disabled')],
+         [Input('houses-player', 'value'), Input('houses-property', 'value')]),
+        ('select_rent', [Output('rent-property', 'options'), Output('rent-price', 'value'),
+                         Output('rent-expected', 'value'), Output('rent-payback', 'value')],
+         [Input('rent-player', 'value'), Input('rent-property', 'value'), Input('rent-dice', 'value')]),
+    ]
+    for function_name, selector_outputs, selector_inputs in selectors:
+        app.clientside_callback(
+            ClientsideFunction(namespace='monopoly', function_name=function_name),
+            selector_outputs,
+            [Input('view-pointer', 'data')] + selector_inputs,
+            [State('history-window', 'data')]
+        )
+
+    # the other devices of the session are kept up to date by the server, see follow_game in monopoly/api.py
+    app.clientside_callback(
+        ClientsideFunction(namespace='monopoly', function_name='follow'),
+        Output('live-state', 'data'),
+        [Input('live-interval', 'n_intervals')],
+        [State('game-state', 'data')]
+    )
 
     @app.callback(
         [
-            Output('mortgage-property', 'options'),
-            Output('mortgage-button', 'disabled'),
-            Output('unmortgage-button', 'disabled'),
+            Output('window-update', 'data'),
+            Output('history-charts', 'figure'),
+            Output('history-charts', 'extendData'),
+            Output('json-size', 'children'),
+            Output('render-state', 'data'),
+            Output('branch-select', 'options'),
         ],
         [
             Input('game-state', 'data'),
-            Input('mortgage-player', 'value'),
-            Input('mortgage-property', 'value'),
+            Input('history-charts', 'relayoutData'),
+            Input('window-request', 'data'),
+        ],
+        [
+            State('render-state', 'data')
         ]
     )
-    def update_mortgage_property(data: str, player: str, prop: str):
-        if not player or not data:
-            raise PreventUpdate
-
-        game_state = Game.from_cache(cache, data)
-        game = game_state.get_current_game()
-
-        player_data = game[player]
-        tradable_properties = definitions.get_tradable_properties(player_data)
-        options = get_options_for_player_properties(tradable_properties, definitions)
+    @METRICS.timed('draw_state')
+    def draw_state(data: str, relayout: Optional[Dict], request: Optional[int], rendered: Optional[Dict]):
+        game_state = Game.load(store, data, definitions, human_players, bank)
+        rendered = rendered or {'series': None, 'zoom': None}
+
+        triggers = [t['prop_id'] for t in dash.callback_context.triggered]
+        zoom = rendered['zoom']
+        if 'history-charts.relayoutData' in triggers:
+            if relayout and 'xaxis.autorange' in relayout:
+                zoom = None
+            else:
+                zoom = get_zoom_range(relayout) or zoom
+
+        # after an action the browser goes back to the pointer, otherwise it is asking for more states
+        # the window the browser holds is still valid while the session and the revision of its history are the same
+        history = [data[0] if store and data else None, game_state.state['revision']]
+        held = rendered.get('window')
+        if not held or held['history'] != history:
+            held = None
+        window = no_update
+        branches = no_update
+        if 'game-state.data' in triggers:
+            window = create_history_window(game_state, definitions, analytics, human_players, all_players,
+                                           game_state.state['pointer'], history_window, True, held)
+            branches = get_branch_options(game_state)
+        elif 'window-request.data' in triggers and request is not None:
+            window = create_history_window(game_state, definitions, analytics, human_players, all_players, request,
+                                           history_window, False)
+        if window is not no_update:
+            held = {'history': history, 'start': window['start'], 'end': window['end'],
+                    'messages_end': window['messages_end']}
+
+        # the chart does not depend on the pointer, and after an action it only needs the new points
+        # unless it is downsampled, in which case it is rebuilt with a bounded number of points
+        series = game_state.get_series_version()
+        previous = rendered['series']
+        fig = no_update
+        extend = no_update
+        if zoom != rendered['zoom']:
+            fig = create_history_figure(game_state, all_players, bank, chart_mode, chart_points, zoom)
+        elif previous and previous[0] == series[0] and previous[1] < series[1] <= chart_points and not zoom:
+            new_x = list(range(previous[1], series[1]))
+            new_points = [list(game_state.get_player_value_history(player)[previous[1]:]) for player in all_players]
+            extend = [{'x': [new_x] * len(all_players), 'y': new_points}, list(range(len(all_players)))]
+        elif previous != series:
+            fig = create_history_figure(game_state, all_players, bank, chart_mode, chart_points, zoom)
 
-        if prop and prop in tradable_properties:
-            mortgage = tradable_properties[prop]['mortgage']
-            unmortgage = not mortgage
+        if not data:
+            json_size = 'Game: new'
+        elif store:
+            json_size = f'Game: {data}'
         else:
-            mortgage = False
-            unmortgage = False
+            json_size = f'Game: {len(data)} bytes'
 
-        return options, mortgage, unmortgage
+        rendered = {'series': series, 'zoom': zoom, 'window': held}
 
-    @app.callback(
-        [
-            Output('houses-property', 'options'),
-            Output('buy-house-button', 'disabled'),
-            Output('sell-house-button', 'disabled'),
-        ],
+        return [window, fig, extend, json_size, rendered, branches]
+
+    # a new state only asks for the log while its tab is shown, and once when it is opened again
+    app.clientside_callback(
+        ClientsideFunction(namespace='monopoly', function_name='log_request'),
+        Output('log-request', 'data'),
         [
             Input('game-state', 'data'),
-            Input('houses-player', 'value'),
-            Input('houses-property', 'value'),
-        ]
+            Input('tabs', 'active_tab'),
+        ],
+        [State('log-request', 'data')]
     )
-    def update_houses_property(data: str, player: str, prop: str):
-        if not player or not data:
-            raise PreventUpdate
-
-        game_state = Game.from_cache(cache, data)
-        game = game_state.get_current_game()
-
-        player_data = game[player]
-        buildable_properties = definitions.get_buildable_properties(player_data)
-        options = get_options_for_player_properties(buildable_properties, definitions)
-
-        if prop and prop in buildable_properties:
-            houses = buildable_properties[prop]['houses']
-            buy = houses == 5
-            sell = houses == 0
-        else:
-            buy = False
-            sell = False
-
-        return options, buy, sell
 
     @app.callback(
         [
-            Output('rent-property', 'options'),
-            Output('rent-price', 'value'),
+            Output('log-table', 'children'),
+            Output('log-position', 'children'),
+            Output('log-page', 'data'),
         ],
         [
-            Input('game-state', 'data'),
-            Input('rent-player', 'value'),
-            Input('rent-property', 'value'),
-            Input('rent-dice', 'value')
+            Input('log-request', 'data'),
+            Input('log-player', 'value'),
+            Input('log-role', 'value'),
+            Input('log-property', 'value'),
+            Input('log-action', 'value'),
+            Input('log-newer-button', 'n_clicks'),
+            Input('log-older-button', 'n_clicks'),
+        ],
+        [
+            State('game-state', 'data'),
+            State('tabs', 'active_tab'),
+            State('log-page', 'data'),
         ]
     )
-    def update_rent_property(data: str, player: str, prop: str, dice: int):
-        if not player or not data:
+    @METRICS.timed('show_log')
+    def show_log(request: Optional[int], player: Optional[str], role: Optional[str], prop: Optional[str],
+                 action: Optional[str], newer_n_clicks: int, older_n_clicks: int, data: str,
+                 active_tab: Optional[str], page: Optional[int]):
+        # only while the log is shown, the page is read from the indexes of the entries, see Game.get_history
+        if active_tab != 'log-tab' or not request:
             raise PreventUpdate
 
-        game_state = Game.from_cache(cache, data)
-        game = game_state.get_current_game()
-
-        rent_properties = definitions.get_rent_properties(player, human_players, game)
-        options = get_options_for_player_properties(rent_properties, definitions)
-
-        if prop and prop in rent_properties:
-            _, price = definitions.get_rent_for_property(prop, dice, game)
+        triggers = [t['prop_id'] for t in dash.callback_context.triggered]
+        page = page or 0
+        if 'log-newer-button.n_clicks' in triggers:
+            page = max(page - 1, 0)
+        elif 'log-older-button.n_clicks' in triggers:
+            page += 1
         else:
-            price = ''
-
-        return options, price
+            # new filters or a new state, back to the newest entries
+            page = 0
+
+        game_state = Game.load(store, data, definitions, human_players, bank)
+        # the player of any role, or only where they have paid ('from') or received ('to')
+        filters = {role or 'player': player, 'property': prop, 'action': action}
+        total, entries = game_state.get_history(filters, page * LOG_ROWS, LOG_ROWS)
+        if not entries and page > 0:
+            # past the oldest entry
+            page = (total - 1) // LOG_ROWS if total else 0
+            total, entries = game_state.get_history(filters, page * LOG_ROWS, LOG_ROWS)
+
+        if total:
+            position = f'{page * LOG_ROWS + 1}-{page * LOG_ROWS + len(entries)} of {total}'
+        else:
+            position = 'No entries'
+        return [create_log_rows(entries), position, page]
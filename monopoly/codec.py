@@ -0,0 +1,136 @@
+import struct
+from array import array
+from typing import Any, Dict, List, Tuple
+
+# compact binary layout for the game state
+# all strings (players, properties, keys and messages) are stored once in a table and referred to by index
+# integers are zig-zag varints, so money and house counts usually take 1 or 2 bytes
+# integer arrays are stored as the raw machine values
+MAGIC = b'MNP1'
+NONE, FALSE, TRUE, INT, STR, LIST, DICT, FLOAT, ARRAY = range(9)
+
+
+def write_varint(out: bytearray, value: int):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode(value: Any) -> bytes:
+    strings: Dict[str, int] = {}
+    body = bytearray()
+
+    def write(v: Any):
+        if v is None:
+            body.append(NONE)
+        elif v is True:
+            body.append(TRUE)
+        elif v is False:
+            body.append(FALSE)
+        elif isinstance(v, int):
+            body.append(INT)
+            write_varint(body, (v << 1) if v >= 0 else ((-v << 1) - 1))
+        elif isinstance(v, str):
+            body.append(STR)
+            write_varint(body, strings.setdefault(v, len(strings)))
+        elif isinstance(v, (list, tuple)):
+            body.append(LIST)
+            write_varint(body, len(v))
+            for item in v:
+                write(item)
+        elif isinstance(v, dict):
+            body.append(DICT)
+            write_varint(body, len(v))
+            for key, item in v.items():
+                write(key)
+                write(item)
+        elif isinstance(v, float):
+            body.append(FLOAT)
+            body.extend(struct.pack('<d', v))
+        elif isinstance(v, array):
+            raw = v.tobytes()
+            body.append(ARRAY)
+            body.extend(v.typecode.encode('ascii'))
+            write_varint(body, len(raw))
+            body.extend(raw)
+        else:
+            raise TypeError(f'Cannot encode {type(v).__name__}')
+
+    write(value)
+
+    out = bytearray(MAGIC)
+    write_varint(out, len(strings))
+    for s in strings:
+        raw = s.encode('utf-8')
+        write_varint(out, len(raw))
+        out.extend(raw)
+    out.extend(body)
+    return bytes(out)
+
+
+def decode(data: bytes) -> Any:
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not an encoded game state')
+
+    pos = len(MAGIC)
+    number_of_strings, pos = read_varint(data, pos)
+    strings: List[str] = []
+    for _ in range(number_of_strings):
+        length, pos = read_varint(data, pos)
+        strings.append(data[pos:pos + length].decode('utf-8'))
+        pos += length
+
+    def read(p: int) -> Tuple[Any, int]:
+        tag = data[p]
+        p += 1
+        if tag == INT:
+            v, p = read_varint(data, p)
+            return (v >> 1) if not v & 1 else -((v + 1) >> 1), p
+        elif tag == STR:
+            v, p = read_varint(data, p)
+            return strings[v], p
+        elif tag == DICT:
+            n, p = read_varint(data, p)
+            result = {}
+            for _ in range(n):
+                key, p = read(p)
+                result[key], p = read(p)
+            return result, p
+        elif tag == LIST:
+            n, p = read_varint(data, p)
+            result = []
+            for _ in range(n):
+                item, p = read(p)
+                result.append(item)
+            return result, p
+        elif tag == NONE:
+            return None, p
+        elif tag == TRUE:
+            return True, p
+        elif tag == FALSE:
+            return False, p
+        elif tag == FLOAT:
+            return struct.unpack_from('<d', data, p)[0], p + 8
+        elif tag == ARRAY:
+            result = array(chr(data[p]))
+            length, p = read_varint(data, p + 1)
+            result.frombytes(data[p:p + length])
+            return result, p + length
+        else:
+            raise ValueError(f'Unknown tag {tag}')
+
+    value, _ = read(pos)
+    return value
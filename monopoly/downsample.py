@@ -0,0 +1,70 @@
+from typing import List, Optional, Sequence, Tuple
+
+
+def lttb(values: Sequence[int], start: int, points: int) -> Tuple[List[int], List[int]]:
+    # largest triangle three buckets: keeps the points which best preserve the shape of the series
+    n = len(values)
+    if points < 3 or n <= points:
+        return list(range(start, start + n)), list(values)
+
+    x = [start]
+    y = [values[0]]
+    size = (n - 2) / (points - 2)
+    a = 0
+    for i in range(points - 2):
+        bucket_start = int(i * size) + 1
+        bucket_end = int((i + 1) * size) + 1
+        next_start = bucket_end
+        next_end = min(int((i + 2) * size) + 1, n)
+        next_values = values[next_start:next_end]
+        average_x = (next_start + next_end - 1) / 2
+        average_y = sum(next_values) / len(next_values)
+
+        a_y = values[a]
+        best = bucket_start
+        best_area = -1
+        for j in range(bucket_start, bucket_end):
+            area = abs((a - average_x) * (values[j] - a_y) - (a - j) * (average_y - a_y))
+            if area > best_area:
+                best_area = area
+                best = j
+        x.append(start + best)
+        y.append(values[best])
+        a = best
+
+    x.append(start + n - 1)
+    y.append(values[n - 1])
+    return x, y
+
+
+def min_max(values: Sequence[int], start: int, points: int) -> Tuple[List[int], List[int]]:
+    # the lowest and highest point of each bucket, in the order they happened
+    n = len(values)
+    if points < 2 or n <= points:
+        return list(range(start, start + n)), list(values)
+
+    x = []
+    y = []
+    buckets = points // 2
+    for i in range(buckets):
+        bucket_start = i * n // buckets
+        bucket_end = (i + 1) * n // buckets
+        bucket = values[bucket_start:bucket_end]
+        low = bucket_start + bucket.index(min(bucket))
+        high = bucket_start + bucket.index(max(bucket))
+        for j in sorted({low, high}):
+            x.append(start + j)
+            y.append(values[j])
+    return x, y
+
+
+def downsample(values: Sequence[int], mode: str, points: int,
+               start: int = 0, end: Optional[int] = None) -> Tuple[List[int], List[int]]:
+    # at most about points (x, y) pairs for values[start:end]
+    window = values[start:end]
+    if mode == 'lttb':
+        return lttb(window, start, points)
+    elif mode == 'minmax':
+        return min_max(window, start, points)
+    else:
+        return list(range(start, start + len(window))), list(window)
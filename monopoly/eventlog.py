@@ -0,0 +1,203 @@
+import atexit
+import contextlib
+import fcntl
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+from monopoly.codec import encode, decode
+from monopoly.game import Game
+from monopoly.store import ConflictError, SessionStore
+
+# one append-only file per session: a snapshot of the whole state, then the records of what happened after it
+# a frame is the length and crc32 of its payload, its kind, and the payload encoded by the codec
+# each write appends the states added since the previous one (see Game.get_delta_records) and a commit record
+# with the pointer: frames after the last commit are from an interrupted write and are ignored
+FRAME = struct.Struct('<IIB')
+SNAPSHOT, RECORD, COMMIT = range(3)
+SESSION_ID = re.compile(r'[0-9A-Za-z_-]{1,64}')
+
+
+def frame(kind: int, value) -> bytes:
+    payload = encode(value)
+    return FRAME.pack(len(payload), zlib.crc32(payload), kind) + payload
+
+
+def read_frames(data) -> Tuple[List[Tuple[int, int, int]], int]:
+    # kind, start and end of the payload of the committed frames, and where the last commit ends
+    frames = []
+    committed = 0
+    end = 0
+    pos = 0
+    while pos + FRAME.size <= len(data):
+        length, crc, kind = FRAME.unpack_from(data, pos)
+        start = pos + FRAME.size
+        if start + length > len(data) or zlib.crc32(data[start:start + length]) != crc:
+            break
+        pos = start + length
+        frames.append((kind, start, pos))
+        if kind == COMMIT:
+            committed = len(frames)
+            end = pos
+    return frames[:committed], end
+
+
+def read_version(f: BinaryIO) -> Optional[int]:
+    # of the last commit, None for an empty file
+    if not os.fstat(f.fileno()).st_size:
+        return None
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        frames, _ = read_frames(data)
+        if not frames:
+            return None
+        _, start, stop = frames[-1]
+        return decode(data[start:stop])['version']
+
+
+def sync_path(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class EventLogSessionStore(SessionStore):
+    # files are fsync-ed in batches every sync_interval seconds, or by each write if it is 0
+    # once a log has compact_records records after its snapshot, the next write replaces it with a new snapshot
+    # the same happens if the file is not as this process has left it, e.g. after an interrupted write
+    # writes of the same session are serialised by a lock on its file, across threads and workers
+
+    def __init__(self, folder: str, sync_interval: float = 1.0, compact_records: int = 256):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.sync_interval = sync_interval
+        self.compact_records = compact_records
+        self.lock = threading.Lock()
+        # for each session: inode and size of its file, number of records after the snapshot and version
+        self.written: Dict[str, Tuple[int, int, int, int]] = {}
+        self.dirty: Set[str] = set()
+
+        if sync_interval > 0:
+            threading.Thread(target=self.sync_loop, daemon=True).start()
+        atexit.register(self.sync)
+
+    def get_path(self, session_id: str) -> Optional[str]:
+        # the session id comes from the browser
+        if not SESSION_ID.fullmatch(session_id):
+            return None
+        return os.path.join(self.folder, f'{session_id}.log')
+
+    def get(self, session_id: str, version: int) -> Optional[Dict]:
+        path = self.get_path(session_id)
+        if path is None:
+            return None
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size == 0:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                frames, end = read_frames(data)
+                if not frames or frames[0][0] != SNAPSHOT:
+                    return None
+
+                game = Game()
+                game.state = decode(data[frames[0][1]:frames[0][2]])
+                for _, start, stop in frames[1:]:
+                    record = decode(data[start:stop])
+                    game.add_record(record)
+
+        game.state['unsaved'] = len(game.state['messages'])
+        game.state['version'] = record['version']
+        with self.lock:
+            # a torn write at the end leaves end short of the size, and the next write replaces the file
+            self.written[session_id] = (stat.st_ino, end, sum(kind == RECORD for kind, _, _ in frames),
+                                        record['version'])
+        return game.state
+
+    def set(self, session_id: str, version: int, state: Dict):
+        path = self.get_path(session_id)
+        if path is None:
+            raise ValueError(f'Invalid session {session_id}')
+
+        game = Game()
+        game.state = state
+        commit = frame(COMMIT, {'type': 'pointer', 'pointer': state['pointer'], 'version': version})
+        with self.open_locked(path) as f:
+            stat = os.fstat(f.fileno())
+            with self.lock:
+                written = self.written.get(session_id)
+            # otherwise the file is not as this process has left it, and its version must be read
+            known = written is not None and written[:2] == (stat.st_ino, stat.st_size)
+            stored = written[3] if known else read_version(f)
+            if stored is not None and stored != version - 1:
+                raise ConflictError(f'Session {session_id} is at version {stored}')
+
+            unsaved = state.get('unsaved')
+            if not known or unsaved is None or unsaved < 0 or written[2] >= self.compact_records:
+                self.write_snapshot(session_id, path, frame(SNAPSHOT, state) + commit, version)
+                return
+
+            records = [frame(RECORD, record) for record in game.get_delta_records(unsaved)]
+            data = b''.join(records) + commit
+            f.write(data)
+            f.flush()
+            if self.sync_interval <= 0:
+                os.fsync(f.fileno())
+            with self.lock:
+                if self.sync_interval > 0:
+                    self.dirty.add(path)
+                self.written[session_id] = (stat.st_ino, stat.st_size + len(data), written[2] + len(records), version)
+
+    @contextlib.contextmanager
+    def open_locked(self, path: str) -> Iterator[BinaryIO]:
+        # the lock of the workers is on the file, which a snapshot can replace while this one waits for it
+        while True:
+            f = open(path, 'ab+')
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                replaced = os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+            except FileNotFoundError:
+                replaced = True
+            if not replaced:
+                break
+            f.close()
+        with f:
+            yield f
+
+    def write_snapshot(self, session_id: str, path: str, data: bytes, version: int):
+        # to a new file, which replaces the log only when it is complete
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+        sync_path(self.folder)
+        with self.lock:
+            self.dirty.discard(path)
+            self.written[session_id] = (os.stat(path).st_ino, len(data), 0, version)
+
+    def sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            self.sync()
+
+    def sync(self):
+        with self.lock:
+            paths, self.dirty = self.dirty, set()
+        for path in paths:
+            try:
+                sync_path(path)
+            except FileNotFoundError:
+                pass
@@ -1,20 +1,62 @@
+import bisect
 import json
+import time
 import uuid
-from typing import List, Dict, Tuple, Optional
-
-from flask_caching import Cache
+from array import array
+from typing import Callable, Iterator, List, Dict, Tuple, Optional, Sequence
 
+from monopoly.delta import Touched, apply_delta, diff_game
+from monopoly.live import BROADCASTER
+from monopoly.metrics import METRICS
+from monopoly.ownership import Ownership
 from monopoly.properties import Properties
-from monopoly.value import get_player_total_value
+from monopoly.store import ConflictError, SessionLocks, SessionStore
+from monopoly.value import get_player_total_value, update_player_total_value
+
+# the actions on a session in this process, one at a time
+SESSION_LOCKS = SessionLocks()
+
+# the fields of a history entry with an index of their own, and its lists of players with the index of each
+INDEXED = ('action', 'property')
+ROLES = {'players': 'player', 'from': 'from', 'to': 'to'}
+
+
+def contains(positions: Sequence[int], i: int) -> bool:
+    # positions is sorted
+    j = bisect.bisect_left(positions, i)
+    return j < len(positions) and positions[j] == i
 
 
 class Game:
+    # a full game is only stored every CHECKPOINT_INTERVAL states, the others are deltas from the previous one
+    CHECKPOINT_INTERVAL = 32
 
     def __init__(self):
         self.state: Dict = {}
 
+    def clear(self):
+        self.state = {'pointer': -1, 'messages': [], 'deltas': [], 'checkpoints': [], 'current': None,
+                      'ownership': None, 'revision': 0, 'series': {}, 'unsaved': 0, 'branches': [], 'entries': [],
+                      'index': {'player': {}, 'from': {}, 'to': {}, 'action': {}, 'property': {}}}
+
+    def copy(self) -> 'Game':
+        # a state read from a store can be shared with other requests (see LRUSessionStore) and is changed on a copy
+        # the lists and columns which grow are copied, the games and deltas in them are never changed in place
+        state = dict(self.state)
+        for key in ('messages', 'deltas', 'checkpoints', 'branches', 'entries'):
+            if key in state:
+                state[key] = list(state[key])
+        state['series'] = {player: {name: column[:] for name, column in columns.items()}
+                           for player, columns in state['series'].items()}
+        if 'index' in state:
+            state['index'] = {kind: {value: positions[:] for value, positions in values.items()}
+                              for kind, values in state['index'].items()}
+        game = Game()
+        game.state = state
+        return game
+
     def initialise(self, definitions: Properties, human_players: List[str], bank: str):
-        self.state = {'pointer': -1, 'stack': []}
+        self.clear()
 
         initial_player_money = 1500
         game = {player: {'money': initial_player_money, 'properties': {}} for player in human_players}
@@ -25,63 +67,349 @@ class Game:
                           prop: {'mortgage': False, 'houses': 0} for prop in definitions.data
                       }
                       }
-        self.add_state(game, 'Start', definitions)
+        self.add_state(game, 'Start', definitions,
+                       entry={'action': 'start', 'players': [], 'from': [], 'to': [], 'property': None, 'amount': 0})
 
     def get_current_game(self) -> Dict:
-        pointer = self.state['pointer']
-        current = self.state['stack'][pointer]
-        return current[0]
+        # the result is shared with the history and must not be modified
+        return self.state['current']
+
+    def get_ownership(self, definitions: Properties) -> Ownership:
+        # it is only rebuilt after moving in the history, actions keep it up to date
+        if self.state['ownership'] is None:
+            self.state['ownership'] = Ownership.build(definitions, self.state['current']).data
+        return Ownership(definitions, self.state['ownership'])
 
-    def add_state(self, game: Dict, msg: str, definitions: Properties):
+    def get_game(self, index: int) -> Dict:
+        checkpoint = index // self.CHECKPOINT_INTERVAL
+        game = self.state['checkpoints'][checkpoint]
+        deltas = self.state['deltas']
+        for i in range(checkpoint * self.CHECKPOINT_INTERVAL + 1, index + 1):
+            game = apply_delta(game, deltas[i])
+        return game
+
+    def get_games(self, start: int, end: int) -> List[Dict]:
+        # the games from start to end included, rebuilt only once from the nearest checkpoint
+        games = [self.get_game(start)]
+        deltas = self.state['deltas']
+        for i in range(start + 1, end + 1):
+            games.append(apply_delta(games[-1], deltas[i]))
+        return games
+
+    def get_game_and_ownership(self, definitions: Properties, index: Optional[int]) -> Tuple[Dict, Ownership]:
+        # the client can show a different state from the pointer, after moving in the history in the browser
+        if index is None or index == self.state['pointer']:
+            return self.get_current_game(), self.get_ownership(definitions)
+        game = self.get_game(index)
+        return game, Ownership.build(definitions, game)
+
+    def add_state(self, game: Dict, msg: str, definitions: Properties, touched: Optional[Touched] = None,
+                  ownership: Optional[Ownership] = None, entry: Optional[Dict] = None):
+        # without touched, the totals of all the players are computed from scratch
+        # ownership must match the new game, if missing it is rebuilt when needed
+        current = self.state['current']
+        if current and touched is not None:
+            for player, properties in touched.items():
+                data = game[player]
+                data['total'] = update_player_total_value(current[player], data, properties, definitions)
+        else:
+            for player, data in game.items():
+                data['total'] = get_player_total_value(data, definitions)
+
+        self.append_state(game, msg, diff_game(current, game, touched) if current else {}, ownership, entry)
+
+    def append_state(self, game: Dict, msg: str, delta: Dict, ownership: Optional[Ownership] = None,
+                     entry: Optional[Dict] = None):
+        # game already has its totals, and delta leads to it from the current game
+        # entry is what msg says as {'action', 'players', 'from', 'to', 'property', 'amount'}, see get_history
+        # the series only hold integers, a game they cannot take is refused before anything changes
+        try:
+            row = {player: array('i', (data['money'], data['total'])) for player, data in game.items()}
+        except (TypeError, OverflowError) as e:
+            raise ValueError(f'Money out of the series: {e}')
         pointer = self.state['pointer']
-        del self.state['stack'][pointer + 1:]
-        for player, data in game.items():
-            data['total'] = get_player_total_value(data, definitions)
-        self.state['stack'].append((game, msg))
+        # sessions saved before the entries were kept have none of them
+        entries = self.state.setdefault('entries', [None] * len(self.state['messages']))
+        index = self.state.setdefault('index', {'player': {}, 'from': {}, 'to': {}, 'action': {}, 'property': {}})
+        if pointer + 1 < len(self.state['messages']):
+            # the future is rewritten, the series of values are no longer an extension of what was there before
+            self.state['revision'] += 1
+            self.stash_branch(pointer)
+            for values in index.values():
+                for value, positions in list(values.items()):
+                    del positions[bisect.bisect_right(positions, pointer):]
+                    if not positions:
+                        del values[value]
+        del entries[pointer + 1:]
+        del self.state['messages'][pointer + 1:]
+        del self.state['deltas'][pointer + 1:]
+        del self.state['checkpoints'][pointer // self.CHECKPOINT_INTERVAL + 1:]
+        for columns in self.state['series'].values():
+            for column in columns.values():
+                del column[pointer + 1:]
+        # the first state a store has not seen yet (-1 for none of them), sessions saved before it was kept have it
+        # missing
+        self.state['unsaved'] = min(self.state.get('unsaved', pointer + 1), pointer + 1)
+
+        self.state['deltas'].append(delta)
+        for player, (money, total) in row.items():
+            columns = self.state['series'].setdefault(player, {'money': array('i'), 'total': array('i')})
+            columns['money'].append(money)
+            columns['total'].append(total)
+        self.state['messages'].append(msg)
+        entries.append(entry)
+        if entry:
+            # the positions of the entries with each value, in order
+            # entries recorded before the roles were kept only have their players
+            keys = [(kind, entry[kind]) for kind in INDEXED]
+            keys += [(kind, player) for role, kind in ROLES.items() for player in entry.get(role, [])]
+            for kind, value in keys:
+                if value:
+                    index.setdefault(kind, {}).setdefault(value, array('i')).append(pointer + 1)
+        if (pointer + 1) % self.CHECKPOINT_INTERVAL == 0:
+            self.state['checkpoints'].append(game)
+        self.state['current'] = game
+        self.state['ownership'] = ownership.data if ownership else None
         self.state['pointer'] += 1
 
+    def stash_branch(self, fork: int):
+        # the states after fork are kept as a branch, with the deltas they already have
+        # branches forking after fork need those states, so they go with them
+        branches = self.state.setdefault('branches', [])
+        inner = [branch for branch in branches if branch['fork'] > fork]
+        self.state['branches'] = [branch for branch in branches if branch['fork'] <= fork]
+        self.state['branches'].append({'fork': fork, 'messages': self.state['messages'][fork + 1:],
+                                       'deltas': self.state['deltas'][fork + 1:],
+                                       'entries': self.state['entries'][fork + 1:], 'branches': inner})
+
+    def get_branches(self) -> List[Tuple[int, str, int]]:
+        # for the branches which can be switched to: the state they fork from, their first message and length
+        return [(branch['fork'], branch['messages'][0], len(branch['messages']))
+                for branch in self.state.get('branches', [])]
+
+    def switch_branch(self, index: int):
+        # the branch takes the place of the states after its fork, which become a branch themselves
+        branch = self.state['branches'].pop(index)
+        self.move(branch['fork'] - self.state['pointer'])
+        entries = branch.get('entries') or [None] * len(branch['messages'])
+        for msg, delta, entry in zip(branch['messages'], branch['deltas'], entries):
+            self.append_state(apply_delta(self.state['current'], delta), msg, delta, entry=entry)
+        self.state['branches'].extend(branch['branches'])
+        # the branches are not in the records of get_delta_records, a store has to write everything again
+        self.state['unsaved'] = -1
+
     def move(self, steps: int):
         pointer = self.state['pointer']
-        upper_bound = len(self.state['stack']) - 1
+        upper_bound = len(self.state['messages']) - 1
         lower_bound = 0
-        self.state['pointer'] = max(lower_bound, min(pointer + steps, upper_bound))
+        new_pointer = max(lower_bound, min(pointer + steps, upper_bound))
+        if new_pointer != pointer:
+            if new_pointer == pointer + 1:
+                self.state['current'] = apply_delta(self.state['current'], self.state['deltas'][new_pointer])
+            else:
+                self.state['current'] = self.get_game(new_pointer)
+            self.state['ownership'] = None
+        self.state['pointer'] = new_pointer
 
     def get_progress(self) -> Tuple[float, str]:
         pointer = self.state['pointer']
-        upper_bound = len(self.state['stack']) - 1
+        upper_bound = len(self.state['messages']) - 1
         progress = (pointer + 1) / (upper_bound + 1)
         return progress, f'{pointer + 1} / {upper_bound + 1}'
 
-    def get_history(self, width: int) -> Tuple[List[Tuple[int, str]], int]:
-        pointer = self.state['pointer']
-        lower = pointer - width
-        upper = pointer + width
-        history = [(i, msg) for i, (_, msg) in enumerate(self.state['stack']) if lower <= i <= upper]
-        return history, pointer
+    def get_history(self, filters: Dict[str, str], offset: int, size: int) -> Tuple[int, List[Tuple[int, str, Dict]]]:
+        # the number of entries matching all the filters ({'player': ..., 'from': ..., 'to': ..., 'action': ...,
+        # 'property': ...}), and a page of them, newest first: index, message and entry (None for those saved before
+        # the entries were kept)
+        # with a single filter the page is a slice of its index, with more the shortest one is checked against the
+        # others with a binary search
+        messages = self.state['messages']
+        entries = self.state.get('entries') or [None] * len(messages)
+        index = self.state.get('index', {})
+        lists = sorted((index.get(kind, {}).get(value, []) for kind, value in filters.items() if value), key=len)
+        if not lists:
+            positions: Sequence[int] = range(len(messages))
+        elif len(lists) == 1:
+            positions = lists[0]
+        else:
+            positions = [i for i in lists[0] if all(contains(other, i) for other in lists[1:])]
 
-    def get_player_value_history(self, player: str) -> List[int]:
-        result = [data[player]['total'] for data, _ in self.state['stack']]
-        return result
+        upper = max(len(positions) - offset, 0)
+        lower = max(upper - size, 0)
+        page = [(i, messages[i], entries[i]) for i in reversed(positions[lower:upper])]
+        return len(positions), page
+
+    def get_series_version(self) -> List[int]:
+        # while the revision is the same, the series of values only grow at the end
+        return [self.state['revision'], len(self.state['messages'])]
+
+    def get_player_value_history(self, player: str) -> Sequence[int]:
+        # the result is shared with the history and must not be modified
+        return self.state['series'][player]['total']
+
+    def get_player_money_history(self, player: str) -> Sequence[int]:
+        # the result is shared with the history and must not be modified
+        return self.state['series'][player]['money']
+
+    def get_records(self) -> Iterator[Dict]:
+        # the history one state at a time: the full game at each checkpoint and the deltas in between
+        # then the branches, see get_line_records
+        line = {'messages': list(self.state['messages']), 'deltas': list(self.state['deltas']),
+                'entries': list(self.state.get('entries') or []), 'branches': list(self.state.get('branches', []))}
+        yield from self.get_line_records(line, 0, list(self.state['checkpoints']))
+        yield {'type': 'pointer', 'pointer': self.state['pointer']}
+
+    def get_line_records(self, line: Dict, start: int, checkpoints: Optional[List[Dict]] = None) -> Iterator[Dict]:
+        # the states of a line from start and its branches: a branch is written after the states up to its fork, and
+        # the line goes on from the fork and replaces it as an action in the past does (see add_record)
+        # only the main line has checkpoints, the branches are all deltas
+        messages = line['messages']
+        deltas = line['deltas']
+        entries = line.get('entries') or [None] * len(messages)
+
+        def get_range(lower: int, upper: int) -> Iterator[Dict]:
+            for i in range(lower, upper):
+                msg = messages[i - start]
+                entry = entries[i - start]
+                if checkpoints is not None and i % self.CHECKPOINT_INTERVAL == 0:
+                    game = checkpoints[i // self.CHECKPOINT_INTERVAL]
+                    yield {'type': 'snapshot', 'index': i, 'message': msg, 'entry': entry, 'game': game}
+                else:
+                    yield {'type': 'delta', 'index': i, 'message': msg, 'entry': entry, 'delta': deltas[i - start]}
+
+        written = start
+        for branch in sorted(line['branches'], key=lambda branch: branch['fork']):
+            fork = branch['fork']
+            yield from get_range(written, fork + 1)
+            written = max(written, fork + 1)
+            yield from self.get_line_records(branch, fork + 1)
+        yield from get_range(written, start + len(messages))
+
+    def get_delta_records(self, start: int) -> Iterator[Dict]:
+        # the states from start on as delta records, which add_record turns into the same history
+        messages = self.state['messages']
+        deltas = self.state['deltas']
+        entries = self.state.get('entries') or [None] * len(messages)
+        for i in range(start, len(messages)):
+            yield {'type': 'delta', 'index': i, 'message': messages[i], 'entry': entries[i], 'delta': deltas[i]}
+
+    def add_record(self, record: Dict):
+        # the opposite of get_records, to be called on a cleared game with the records in the same order
+        # a record before the end of the history starts a new branch from the state before it
+        kind = record.get('type')
+        if kind == 'pointer':
+            self.move(record['pointer'] - self.state['pointer'])
+            return
+
+        index = record.get('index')
+        length = len(self.state['messages'])
+        if not isinstance(index, int) or not (index == length or 0 < index < length):
+            raise ValueError(f'Record {index} is out of order')
+        entry = record.get('entry')
+        if entry is not None and not (isinstance(entry, dict) and isinstance(entry.get('players'), list) and
+                                      all(isinstance(entry.get(role, []), list) for role in ROLES)):
+            raise ValueError(f'Record {index} has an invalid entry')
+        if index > 0:
+            self.move(index - 1 - self.state['pointer'])
+        current = self.state['current']
+        if kind == 'snapshot':
+            game = record['game']
+            self.append_state(game, record['message'], diff_game(current, game) if current else {}, entry=entry)
+        elif kind == 'delta':
+            if current is None:
+                raise ValueError('The history must start with a snapshot')
+            delta = record['delta']
+            self.append_state(apply_delta(current, delta), record['message'], delta, entry=entry)
+        else:
+            raise ValueError(f'Unknown record {kind}')
+
+    @staticmethod
+    def load(store: Optional[SessionStore], data, definitions: Properties, human_players: List[str],
+             bank: str) -> 'Game':
+        # a game is only saved by its first action, until then (or after its session has expired) it is a new one
+        if data:
+            game_state = Game.from_cache(store, data)
+            if game_state.state:
+                return game_state
+
+        game_state = Game()
+        game_state.initialise(definitions, human_players, bank)
+        return game_state
 
     @staticmethod
-    def from_cache(cache: Optional[Cache], data) -> 'Game':
-        if cache:
-            session_id = data[0]
-            state = cache.get(session_id)
+    def update(store: Optional[SessionStore], data, definitions: Properties, human_players: List[str], bank: str,
+               change: Callable[['Game', bool], bool], retries: int = 5):
+        # load, change and save a game, the result is the new data for the client (data itself if change returns
+        # False, as there is nothing to save)
+        # stale tells change that the game is newer than the version of the client, e.g. another device has acted
+        # if another worker saves the session first, the change is made again on top of what it has saved
+        # the devices following the session are sent the new states
+        if not store or not data:
+            game_state = Game.load(store, data, definitions, human_players, bank)
+            return game_state.to_cache(store, data) if change(game_state, False) else data
+
+        session_id, version = data
+        with SESSION_LOCKS.hold(session_id):
+            for _ in range(retries):
+                game_state = Game.from_cache(store, data)
+                if not game_state.state:
+                    # the session has expired (or was never saved): the new game is saved as a new session, the
+                    # old id can still be known elsewhere, e.g. by a device which has joined it
+                    game_state = Game.load(store, None, definitions, human_players, bank)
+                    return game_state.to_cache(store, None) if change(game_state, False) else data
+                game_state = game_state.copy()
+                # what a store returns is saved, whatever it had when it was encoded
+                game_state.state['unsaved'] = len(game_state.state['messages'])
+                stale = game_state.state.get('version', version) != version
+                if not change(game_state, stale):
+                    return data
+                try:
+                    result = game_state.to_cache(store, data)
+                except ConflictError:
+                    continue
+                if BROADCASTER.is_followed(session_id):
+                    # only the new version: a follower loads it like any other session
+                    BROADCASTER.publish(session_id, {'session': result, 'pointer': game_state.state['pointer']})
+                return result
+        raise ConflictError(f'Session {session_id} is still changing after {retries} attempts')
+
+    @staticmethod
+    def from_cache(store: Optional[SessionStore], data) -> 'Game':
+        start = time.perf_counter()
+        if store:
+            session_id, version = data
+            state = store.get(session_id, version)
         else:
             state = json.loads(data)
+        if METRICS.enabled:
+            METRICS.cache_seconds.observe(time.perf_counter() - start, 'read')
 
         game = Game()
         game.state = state
         return game
 
-    def to_cache(self, cache: Optional[Cache], data):
-        if cache:
+    def to_cache(self, store: Optional[SessionStore], data):
+        start = time.perf_counter()
+        if store:
             if not data:
                 data = [str(uuid.uuid4()), 0]
 
-            session_id = data[0]
-            cache.set(session_id, self.state)
-            return [session_id, data[1] + 1]
+            session_id, version = data
+            # the version the state was read at, the client can be behind it
+            version = self.state.get('version', version) + 1
+            self.state['version'] = version
+            store.set(session_id, version, self.state)
+            # what has been saved can be shared from now on, and it is not changed any more
+            self.state = dict(self.state, unsaved=len(self.state['messages']))
+            result = [session_id, version]
         else:
-            return json.dumps(self.state)
+            self.state['unsaved'] = len(self.state['messages'])
+            # the series are read back as lists, which work the same
+            result = json.dumps(self.state, default=list)
+            if METRICS.enabled:
+                METRICS.state_bytes.observe(len(result))
+
+        if METRICS.enabled:
+            METRICS.cache_seconds.observe(time.perf_counter() - start, 'write')
+            METRICS.history_length.observe(len(self.state['messages']))
+        return result
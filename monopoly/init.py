@@ -1,19 +1,26 @@
 from typing import Optional
 
-from flask_caching import Cache
-
+from monopoly.analytics import Analytics
+from monopoly.api import api_routes
 from monopoly.callbacks import register_callbacks
 from monopoly.layout import create_layout
 from monopoly.properties import Properties
+from monopoly.store import SessionStore
 from monopoly.update import update_callbacks
 
 
-def populate_game(app, cache: Optional[Cache]):
+def populate_game(app, store: Optional[SessionStore], chart_mode: str = 'lttb', chart_points: int = 500,
+                  history_window: int = 20):
     human_players = ['Amsi', 'Ofi', 'Pappo']
     bank = 'Mafia'
     property_definitions = Properties()
+    analytics = Analytics(property_definitions, len(human_players))
 
     app.title = 'Monopoly'
-    app.layout = lambda: create_layout(cache, property_definitions, human_players, bank)
-    register_callbacks(cache, app, property_definitions, human_players, bank)
-    update_callbacks(cache, app, property_definitions, human_players, bank)
+    app.layout = create_layout(store, property_definitions, human_players, bank)
+    register_callbacks(store, app, property_definitions, analytics, human_players, bank, chart_mode, chart_points,
+                       history_window)
+    update_callbacks(store, app, property_definitions, human_players, bank)
+    if store:
+        # without a store the game only exists in the browser
+        api_routes(store, app.server, property_definitions, human_players, bank)
@@ -3,17 +3,16 @@ from typing import List, Optional
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
-from flask_caching import Cache
 
-from monopoly.game import Game
 from monopoly.properties import Properties
+from monopoly.store import SessionStore
+from monopoly.update import ACTIONS, get_action_registry
 
 EMPTY_SELECT = [{'label': ''}]
 
 
-def create_layout(cache: Optional[Cache], definitions: Properties, human_players: List[str], bank: str):
-    game_state = Game()
-    game_state.initialise(definitions, human_players, bank)
+def create_layout(store: Optional[SessionStore], definitions: Properties, human_players: List[str], bank: str):
+    # built once and shared by all the page loads, the game is only created by its first action
 
     player_columns = []
     player_selects = []
@@ -121,6 +120,14 @@ def create_layout(cache: Optional[Cache], definitions: Properties, human_players
             dbc.Label('Rent', html_for='rent-price'),
             dbc.Col(dbc.Input(id='rent-price', disabled=True))
         ], row=True),
+        dbc.FormGroup([
+            dbc.Label('Expected rent per turn', html_for='rent-expected'),
+            dbc.Col(dbc.Input(id='rent-expected', disabled=True))
+        ], row=True),
+        dbc.FormGroup([
+            dbc.Label('Payback (rounds)', html_for='rent-payback'),
+            dbc.Col(dbc.Input(id='rent-payback', disabled=True))
+        ], row=True),
         dbc.Button('Pay rent', id='pay-rent-button', color="danger", className="mr-1"),
     ])))
 
@@ -128,6 +135,38 @@ def create_layout(cache: Optional[Cache], definitions: Properties, human_players
         dcc.Graph(id='history-charts')
     ))
 
+    # the entries of the history which match all the filters, a page at a time from the newest
+    action_selects = [{'label': name.replace('_', ' ').capitalize(), 'value': name}
+                      for name in ['start'] + list(ACTIONS) + ['batch']]
+    log_tab = dbc.Card(dbc.CardBody([
+        dbc.Form([
+            dbc.FormGroup([
+                dbc.Label('Player', html_for='log-player'),
+                dbc.Col(dbc.Select(id='log-player', options=EMPTY_SELECT + actual_players_selects))
+            ], row=True),
+            dbc.FormGroup([
+                dbc.Label('Role', html_for='log-role'),
+                dbc.Col(dbc.Select(id='log-role', options=EMPTY_SELECT + [{'label': 'Paid', 'value': 'from'},
+                                                                          {'label': 'Received', 'value': 'to'}]))
+            ], row=True),
+            dbc.FormGroup([
+                dbc.Label('Property', html_for='log-property'),
+                dbc.Col(dbc.Select(id='log-property',
+                                   options=EMPTY_SELECT + [{'label': prop} for prop in definitions.sorted_names]))
+            ], row=True),
+            dbc.FormGroup([
+                dbc.Label('Action', html_for='log-action'),
+                dbc.Col(dbc.Select(id='log-action', options=EMPTY_SELECT + action_selects))
+            ], row=True),
+        ]),
+        dbc.Table(id='log-table', size='sm'),
+        dbc.ButtonGroup([
+            dbc.Button('Newer', id='log-newer-button', color='secondary', className="mr-1"),
+            dbc.Button('Older', id='log-older-button', color='secondary', className="mr-1"),
+        ]),
+        html.Span(id='log-position', className="ml-2"),
+    ]))
+
     control_panel = [
         dbc.Row(dbc.Col(dbc.Alert('Monopoly @ Cratbree'))),
         dbc.Row(dbc.Col(dbc.Alert(id='json-size', color='info'))),
@@ -140,6 +179,9 @@ def create_layout(cache: Optional[Cache], definitions: Properties, human_players
         dbc.Row(dbc.Col(dbc.Progress(id='game-progress'))),
         html.Br(),
         dbc.Row(dbc.Col(dbc.Table(id='history-table'))),
+        # the states replaced by an action in the past are kept, and can be brought back
+        dbc.Row(dbc.Col(dbc.Select(id='branch-select', options=EMPTY_SELECT))),
+        dbc.Row(dbc.Col(dbc.Button('Switch branch', id='branch-button', color='warning', className="mr-1"))),
     ]
 
     game_layout = dbc.Container([
@@ -147,7 +189,7 @@ def create_layout(cache: Optional[Cache], definitions: Properties, human_players
         dbc.Row([
             dbc.Col(control_panel, width=2),
             dbc.Col([
-                dbc.Row(dbc.Col(dbc.Tabs([
+                dbc.Row(dbc.Col(dbc.Tabs(id='tabs', children=[
                     dbc.Tab(charts_tab, label="Charts"),  # must be first due to a dash bug
                     dbc.Tab(pay_receive_tab, label="Money"),
                     dbc.Tab(property_dealing_tab, label="Trading"),
@@ -155,6 +197,7 @@ def create_layout(cache: Optional[Cache], definitions: Properties, human_players
                     dbc.Tab(mortgage_tab, label="Mortgage"),
                     dbc.Tab(buildings_tab, label="Buildings"),
                     dbc.Tab(rent_tab, label="Rent"),
+                    dbc.Tab(log_tab, label="Log", tab_id='log-tab'),
                 ]))),
                 html.Br(),
                 dbc.Row(player_columns),
@@ -162,9 +205,24 @@ def create_layout(cache: Optional[Cache], definitions: Properties, human_players
         ])
     ], fluid=True)
 
-    data = game_state.to_cache(cache, None)
-    store = dcc.Store(id='game-state', data=data)
-
-    layout = html.Div([store, game_layout])
+    # with a server side store only the session id is kept, so it is resumed when the page is loaded again
+    game_store = dcc.Store(id='game-state', storage_type='local' if store else 'memory')
+    # what the client is showing, so only what has changed is sent again
+    render_state = dcc.Store(id='render-state')
+    # the states around the pointer, the one shown and the ones asked by the browser
+    # the server sends a new window, or what comes after the one the browser has, to window-update
+    history_stores = [dcc.Store(id=name) for name in ['history-window', 'window-update', 'history-pointer',
+                                                      'view-pointer', 'window-request']]
+    # the page of the log shown, 0 for the newest entries, and a counter of the states the log has been asked for
+    history_stores += [dcc.Store(id='log-page', data=0), dcc.Store(id='log-request')]
+
+    # the browser follows the server-sent events of its session and puts the latest version in live-state
+    # it checks for one on each tick of live-interval, which does not reach the server
+    live = [dcc.Store(id='live-state'), dcc.Interval(id='live-interval', interval=500, disabled=not store)]
+
+    # the action of each button and the components of its arguments, and the last one clicked
+    actions = [dcc.Store(id='action-registry', data=get_action_registry()), dcc.Store(id='action-request')]
+
+    layout = html.Div([game_store, render_state] + history_stores + live + actions + [game_layout])
 
     return layout
@@ -0,0 +1,54 @@
+import json
+import queue
+import threading
+from typing import Dict, Set
+
+# the devices following a session in this process, see the events route in monopoly/api.py
+# an event is encoded once for all of them, and a device which does not keep up loses the oldest events:
+# the browser only needs the latest version of the session
+
+
+class Broadcaster:
+    QUEUE_SIZE = 16
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers: Dict[str, Set[queue.Queue]] = {}
+
+    def subscribe(self, session_id: str) -> queue.Queue:
+        events: queue.Queue = queue.Queue(self.QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.setdefault(session_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, session_id: str, events: queue.Queue):
+        with self.lock:
+            subscribers = self.subscribers.get(session_id)
+            if subscribers is not None:
+                subscribers.discard(events)
+                if not subscribers:
+                    del self.subscribers[session_id]
+
+    def is_followed(self, session_id: str) -> bool:
+        return session_id in self.subscribers
+
+    def publish(self, session_id: str, event: Dict):
+        with self.lock:
+            subscribers = list(self.subscribers.get(session_id, ()))
+        if not subscribers:
+            return
+
+        data = json.dumps(event)
+        for events in subscribers:
+            while True:
+                try:
+                    events.put_nowait(data)
+                    break
+                except queue.Full:
+                    try:
+                        events.get_nowait()
+                    except queue.Empty:
+                        pass
+
+
+BROADCASTER = Broadcaster()
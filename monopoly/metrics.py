@@ -0,0 +1,111 @@
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Sequence
+
+# histograms and counters in the prometheus text format, kept by each process
+# when metrics are not enabled the callbacks are registered unwrapped and the rest only checks a flag
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1 << 10, 4 << 10, 16 << 10, 64 << 10, 256 << 10, 1 << 20, 4 << 20, 16 << 20)
+LENGTH_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000)
+
+
+class Histogram:
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], label: str = ''):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.label = label
+        self.lock = threading.Lock()
+        # for each value of the label: the count of each bucket (not cumulative), then the sum
+        self.values: Dict[str, List[float]] = {}
+
+    def observe(self, value: float, label: str = ''):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            values = self.values.get(label)
+            if values is None:
+                values = self.values[label] = [0] * (len(self.buckets) + 2)
+            values[i] += 1
+            values[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            values = {label: list(counts) for label, counts in sorted(self.values.items())}
+
+        for label, counts in values.items():
+            labels = f'{self.label}="{label}",' if self.label else ''
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            labels = f'{{{labels[:-1]}}}' if labels else ''
+            lines.append(f'{self.name}_sum{labels} {counts[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name: str, documentation: str, label: str = ''):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.lock = threading.Lock()
+        self.values: Dict[str, int] = {}
+
+    def inc(self, label: str = ''):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self.lock:
+            values = sorted(self.values.items())
+
+        for label, count in values:
+            labels = f'{{{self.label}="{label}"}}' if self.label else ''
+            lines.append(f'{self.name}{labels} {count}')
+        return lines
+
+
+class Metrics:
+
+    def __init__(self):
+        self.enabled = False
+        self.callback_seconds = Histogram('monopoly_callback_seconds', 'Wall time of the Dash callbacks.',
+                                          DURATION_BUCKETS, 'callback')
+        self.cache_seconds = Histogram('monopoly_cache_seconds', 'Time to read or write the game state.',
+                                       DURATION_BUCKETS, 'operation')
+        self.state_bytes = Histogram('monopoly_state_bytes', 'Size of the serialized game state.', SIZE_BUCKETS)
+        self.history_length = Histogram('monopoly_history_length', 'Number of states in the game history.',
+                                        LENGTH_BUCKETS)
+        self.session_cache = Counter('monopoly_session_cache_total', 'Reads of the in-process session cache.',
+                                     'result')
+
+    def timed(self, name: str) -> Callable:
+        # to be applied below @app.callback, after the metrics have been enabled
+        def decorator(function: Callable) -> Callable:
+            if not self.enabled:
+                return function
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.callback_seconds.observe(time.perf_counter() - start, name)
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        metrics = [self.callback_seconds, self.cache_seconds, self.state_bytes, self.history_length,
+                   self.session_cache]
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+METRICS = Metrics()
@@ -0,0 +1,88 @@
+from typing import Dict, List, Tuple
+
+from monopoly.properties import Properties
+
+
+class Ownership:
+    # who owns each property, how many properties of each group and which ones can collect rent
+    # it is stored alongside the current game, so rents do not need to look at the players
+
+    def __init__(self, definitions: Properties, data: Dict):
+        self.definitions = definitions
+        self.data = data
+
+    @staticmethod
+    def build(definitions: Properties, game: Dict) -> 'Ownership':
+        ownership = Ownership(definitions, {'owners': {}, 'groups': {}, 'rentable': {}})
+        for player, player_data in game.items():
+            for prop, prop_data in player_data['properties'].items():
+                ownership.add(player, prop, prop_data['mortgage'])
+        return ownership
+
+    def copy(self) -> 'Ownership':
+        data = {
+            'owners': dict(self.data['owners']),
+            'groups': {owner: dict(counts) for owner, counts in self.data['groups'].items()},
+            'rentable': {owner: list(props) for owner, props in self.data['rentable'].items()},
+        }
+        return Ownership(self.definitions, data)
+
+    def get_owner(self, prop: str) -> str:
+        return self.data['owners'][prop]
+
+    def get_group_count(self, owner: str, color: str) -> int:
+        return self.data['groups'].get(owner, {}).get(color, 0)
+
+    def get_rentable_properties(self, owner: str) -> List[str]:
+        return self.data['rentable'].get(owner, [])
+
+    def get_rent_properties(self, player: str, humans: List[str]) -> Dict:
+        result = {}
+        for human in humans:
+            if human != player:
+                for prop in self.get_rentable_properties(human):
+                    result[prop] = self.definitions.data[prop]
+        return result
+
+    def get_rent_for_property(self, prop: str, dice: int, game: Dict) -> Tuple[str, int]:
+        owner = self.get_owner(prop)
+        prop_data = game[owner]['properties'][prop]
+        if prop_data['mortgage']:
+            rent = 0
+        else:
+            color = self.definitions.colors[self.definitions.ids[prop]]
+            owned = self.get_group_count(owner, color)
+            rent = self.definitions.get_rent(prop, prop_data['houses'], owned, dice)
+        return owner, rent
+
+    def add(self, owner: str, prop: str, mortgage: bool):
+        color = self.definitions.colors[self.definitions.ids[prop]]
+        self.data['owners'][prop] = owner
+        counts = self.data['groups'].setdefault(owner, {})
+        counts[color] = counts.get(color, 0) + 1
+        if not mortgage:
+            self.data['rentable'].setdefault(owner, []).append(prop)
+
+    def remove(self, owner: str, prop: str):
+        color = self.definitions.colors[self.definitions.ids[prop]]
+        del self.data['owners'][prop]
+        counts = self.data['groups'][owner]
+        counts[color] -= 1
+        if not counts[color]:
+            del counts[color]
+        rentable = self.data['rentable'].get(owner, [])
+        if prop in rentable:
+            rentable.remove(prop)
+
+    def transfer(self, prop: str, seller: str, buyer: str):
+        mortgage = prop not in self.get_rentable_properties(seller)
+        self.remove(seller, prop)
+        self.add(buyer, prop, mortgage)
+
+    def set_mortgage(self, prop: str, mortgage: bool):
+        owner = self.get_owner(prop)
+        rentable = self.data['rentable'].setdefault(owner, [])
+        if mortgage:
+            rentable.remove(prop)
+        else:
+            rentable.append(prop)
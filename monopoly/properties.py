@@ -1,28 +1,61 @@
+import csv
 import os.path
 from typing import Dict, List, Tuple
 
-import pandas as pd
-
 
 class Properties:
     FOREGROUND = {'Brown': 'white', 'Dark Blue': 'white'}
     HOUSES = ['1 house', '2 houses', '3 houses', '4 houses', 'hotel']
     STATION_RENT = [1, 2, 4, 8]
     UTILITY_RENT = [4, 10]
+    GO_SALARY = 200
+    INCOME_TAX = 200
+    SUPER_TAX = 100
+    JAIL_FINE = 50
+    NUMERIC = ['price', 'house price', 'rent'] + HOUSES
 
     def __init__(self):
         file_name = "properties.csv"
         this_folder = os.path.dirname(os.path.abspath(__file__))
         path = os.path.join(this_folder, file_name)
-        static = pd.read_csv(path, index_col='name')
-        self.data = static.to_dict(orient='index')
-        self.groups = static.groupby('color')['rule'].count().to_dict()
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+
+        for row in rows:
+            for column in self.NUMERIC:
+                value = row[column].strip()
+                row[column] = int(value) if value else 0
+
+        # everything is precomputed here and indexed by the position of the property in the csv file
+        self.names: Tuple[str, ...] = tuple(row.pop('name') for row in rows)
+        self.ids: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self.data: Dict[str, Dict] = dict(zip(self.names, rows))
+
+        self.colors: Tuple[str, ...] = tuple(row['color'] for row in rows)
+        self.rules: Tuple[str, ...] = tuple(row['rule'] for row in rows)
+        self.prices: Tuple[int, ...] = tuple(row['price'] for row in rows)
+        self.house_prices: Tuple[int, ...] = tuple(row['house price'] for row in rows)
+        # rent with no houses, then with 1 to 4 houses and the hotel
+        self.rents: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(row[column] for column in ['rent'] + self.HOUSES) for row in rows
+        )
+
+        members: Dict[str, List[str]] = {}
+        for name, color in zip(self.names, self.colors):
+            members.setdefault(color, []).append(name)
+        self.group_members: Dict[str, Tuple[str, ...]] = {color: tuple(names) for color, names in members.items()}
+        self.groups: Dict[str, int] = {color: len(names) for color, names in members.items()}
+
+        self.sorted_names: Tuple[str, ...] = tuple(sorted(self.names, key=lambda name: self.prices[self.ids[name]]))
+        self.ranks: Dict[str, int] = {name: i for i, name in enumerate(self.sorted_names)}
+
+        self.styles: Tuple[Dict, ...] = tuple(
+            {'background-color': color.replace(' ', ''), 'color': self.FOREGROUND.get(color, 'black')}
+            for color in self.colors
+        )
 
     def get_color_style(self, prop: str, data: Dict) -> Dict:
-        group = self.data[prop]['color']
-        background = group.replace(' ', '')
-        foreground = self.FOREGROUND.get(group, 'black')
-        style = {'background-color': background, 'color': foreground}
+        style = dict(self.styles[self.ids[prop]])
 
         if data[prop]['mortgage']:
             style['opacity'] = 0.2
@@ -31,87 +64,61 @@ class Properties:
 
     def get_tradable_properties(self, player_data: Dict) -> Dict:
         # can only sell or mortgage properties with no houses
-        built_groups = {self.data[k]['color'] for k, v in player_data['properties'].items() if v['houses'] > 0}
-        properties = {k: v for k, v in player_data['properties'].items() if self.data[k]['color'] not in built_groups}
+        built_groups = {self.colors[self.ids[k]] for k, v in player_data['properties'].items() if v['houses'] > 0}
+        properties = {k: v for k, v in player_data['properties'].items()
+                      if self.colors[self.ids[k]] not in built_groups}
         return properties
 
     def get_buildable_properties(self, player_data: Dict) -> Dict:
         owned = {}
         for prop, prop_data in player_data['properties'].items():
-            rule = self.data[prop]['rule']
-            if rule == 'Normal':
+            i = self.ids[prop]
+            if self.rules[i] == 'Normal':
                 if not prop_data['mortgage']:
-                    color = self.data[prop]['color']
-                    if color not in owned:
-                        owned[color] = 0
-                    owned[color] += 1
+                    color = self.colors[i]
+                    owned[color] = owned.get(color, 0) + 1
 
         buildable_groups = {color for color, count in owned.items() if count == self.groups[color]}
 
         # can only sell or mortgage properties with no houses
-        properties = {k: v for k, v in player_data['properties'].items() if self.data[k]['color'] in buildable_groups}
+        properties = {k: v for k, v in player_data['properties'].items()
+                      if self.colors[self.ids[k]] in buildable_groups}
         return properties
 
     def get_property_value(self, prop: str, player_data: Dict) -> int:
         is_mortgaged = player_data['properties'][prop]['mortgage']
-        price = self.data[prop]['price']
+        price = self.prices[self.ids[prop]]
         if is_mortgaged:
             # deduct interests
             price = price * 45 // 100
-        return int(price)
+        return price
 
     def get_redemption_cost(self, prop: str) -> int:
-        value = self.data[prop]['price'] * 11 // 20
-        return int(value)
+        return self.prices[self.ids[prop]] * 11 // 20
 
     def get_mortgage_value(self, prop: str) -> int:
-        value = self.data[prop]['price'] // 2
-        return int(value)
+        return self.prices[self.ids[prop]] // 2
 
     def get_house_price(self, prop: str) -> int:
-        price = self.data[prop]['house price']
-        return int(price)
+        return self.house_prices[self.ids[prop]]
 
     def get_sorted_properties(self, properties: Dict) -> List[str]:
-        def value(prop: str) -> int:
-            return self.data[prop]['price']
-
-        s = sorted(properties.keys(), key=value)
-        return s
-
-    def get_rent_properties(self, player: str, humans: List[str], game: Dict) -> Dict:
-        result = {}
-        for human in humans:
-            if human != player:
-                human_data = game[human]
-                for prop, data in human_data['properties'].items():
-                    if not data['mortgage']:
-                        result[prop] = self.data[prop]
-        return result
-
-    def get_rent_for_property(self, prop: str, dice: int, game: Dict) -> Tuple[str, int]:
-        owner = None
-        for player, data in game.items():
-            if prop in data['properties']:
-                owner = player
-                break
-
-        owner_properties = game[owner]['properties']
-        if owner_properties[prop]['mortgage']:
-            rent = 0
-        else:
-            prop_data = self.data[prop]
-            number_of_houses = owner_properties[prop]['houses']
-            if number_of_houses > 0:
-                rent = prop_data[self.HOUSES[number_of_houses - 1]]
-            else:
-                owned = [k for k in owner_properties if self.data[k]['color'] == prop_data['color']]
-                rent = prop_data['rent']
-                if prop_data['rule'] == 'Normal':
-                    if len(owned) == self.groups[prop_data['color']]:
-                        rent *= 2
-                elif prop_data['rule'] == 'Station':
-                    rent *= self.STATION_RENT[len(owned) - 1]
-                elif prop_data['rule'] == 'Utility':
-                    rent = dice * self.UTILITY_RENT[len(owned) - 1]
-        return owner, int(rent)
+        return sorted(properties, key=self.ranks.__getitem__)
+
+    def get_rent(self, prop: str, houses: int, owned: int, dice: int) -> int:
+        # owned is the number of properties of the same group held by the owner
+        i = self.ids[prop]
+        rents = self.rents[i]
+        if houses > 0:
+            return rents[houses]
+
+        rent = rents[0]
+        rule = self.rules[i]
+        if rule == 'Normal':
+            if owned == self.groups[self.colors[i]]:
+                rent *= 2
+        elif rule == 'Station':
+            rent *= self.STATION_RENT[owned - 1]
+        elif rule == 'Utility':
+            rent = dice * self.UTILITY_RENT[owned - 1]
+        return rent
@@ -0,0 +1,261 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from monopoly import board
+from monopoly.properties import Properties
+
+RULES = ['Normal', 'Station', 'Utility']
+
+
+class Simulator:
+    # plays many games in lockstep: every array has one row per game and the player to move is turn[game]
+    # token positions and whose turn it is are not part of a game, so each rollout starts from random ones
+    # the players buy what they land on, build evenly on complete groups and mortgage when short of money
+    # chance and community chest are ignored, going to jail costs the fine straight away
+
+    def __init__(self, definitions: Properties, human_players: List[str], reserve: int = 200):
+        self.definitions = definitions
+        self.human_players = human_players
+        # money a player keeps aside before buying or building
+        self.reserve = reserve
+
+        colors = sorted(definitions.groups)
+        self.square_properties = np.array(board.get_square_properties(definitions))
+        self.prices = np.array(definitions.prices)
+        self.house_prices = np.array(definitions.house_prices)
+        self.rents = np.array(definitions.rents)
+        self.rules = np.array([RULES.index(rule) for rule in definitions.rules])
+        self.groups = np.array([colors.index(color) for color in definitions.colors])
+        self.group_members = [np.array([definitions.ids[prop] for prop in definitions.group_members[color]])
+                              for color in colors]
+        self.group_sizes = np.array([definitions.groups[color] for color in colors])
+        # which group each property belongs to, to count the properties of each group with a product
+        self.membership = (self.groups[:, None] == np.arange(len(colors))[None, :]).astype(np.float32)
+        self.normal_groups = np.array([self.rules[members[0]] == 0 for members in self.group_members])
+        self.station_rent = np.array(definitions.STATION_RENT)
+        self.utility_rent = np.array(definitions.UTILITY_RENT)
+        self.by_price = np.argsort(self.prices, kind='stable')
+
+    def start(self, game: Dict, rollouts: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+        players = len(self.human_players)
+        number_of_properties = len(self.prices)
+        owner = np.full(number_of_properties, -1, dtype=np.int8)
+        houses = np.zeros(number_of_properties, dtype=np.int8)
+        mortgaged = np.zeros(number_of_properties, dtype=bool)
+        for p, player in enumerate(self.human_players):
+            for prop, data in game[player]['properties'].items():
+                i = self.definitions.ids[prop]
+                owner[i] = p
+                houses[i] = data['houses']
+                mortgaged[i] = data['mortgage']
+
+        money = np.array([game[player]['money'] for player in self.human_players], dtype=np.int64)
+        # properties of each group held and mortgaged by each player, kept up to date as they change
+        owned = np.zeros((players, len(self.group_sizes)), dtype=np.int8)
+        blocked = np.zeros_like(owned)
+        for i, p in enumerate(owner):
+            if p >= 0:
+                owned[p, self.groups[i]] += 1
+                blocked[p, self.groups[i]] += mortgaged[i]
+        return {
+            'money': np.tile(money, (rollouts, 1)),
+            'alive': np.ones((rollouts, players), dtype=bool),
+            'position': rng.integers(0, len(board.SQUARES), (rollouts, players)),
+            'turn': rng.integers(0, players, rollouts),
+            'owner': np.tile(owner, (rollouts, 1)),
+            'houses': np.tile(houses, (rollouts, 1)),
+            'mortgaged': np.tile(mortgaged, (rollouts, 1)),
+            'owned': np.tile(owned, (rollouts, 1, 1)),
+            'blocked': np.tile(blocked, (rollouts, 1, 1)),
+        }
+
+    def get_rent(self, state: Dict[str, np.ndarray], rows: np.ndarray, props: np.ndarray,
+                 owners: np.ndarray, dice: np.ndarray) -> np.ndarray:
+        # same rules as Properties.get_rent, for one property in each of the rows
+        group = self.groups[props]
+        owned = state['owned'][rows, owners, group]
+        owned_index = np.maximum(owned - 1, 0)
+
+        houses = state['houses'][rows, props]
+        base = self.rents[props, 0]
+        rule = self.rules[props]
+        normal = np.where(owned == self.group_sizes[group], base * 2, base)
+        normal = np.where(houses > 0, self.rents[props, houses], normal)
+        station = base * self.station_rent[np.minimum(owned_index, len(self.station_rent) - 1)]
+        utility = dice * self.utility_rent[np.minimum(owned_index, len(self.utility_rent) - 1)]
+        return np.choose(rule, [normal, station, utility])
+
+    def step(self, state: Dict[str, np.ndarray], rng: np.random.Generator):
+        rollouts, players = state['money'].shape
+        rows = np.arange(rollouts)
+        turn = state['turn']
+        money = state['money']
+        active = state['alive'].sum(axis=1) > 1
+
+        dice = rng.integers(1, 7, rollouts) + rng.integers(1, 7, rollouts)
+        old = state['position'][rows, turn]
+        new = (old + dice) % len(board.SQUARES)
+        passed_go = new < old
+        to_jail = new == board.GO_TO_JAIL
+        new = np.where(to_jail, board.JAIL, new)
+        state['position'][rows, turn] = np.where(active, new, old)
+
+        # money of the player to move, written back once all its own payments are known
+        cash = money[rows, turn]
+        cash += passed_go * Properties.GO_SALARY
+        cash -= (to_jail * Properties.JAIL_FINE + (new == board.INCOME_TAX) * Properties.INCOME_TAX
+                 + (new == board.SUPER_TAX) * Properties.SUPER_TAX)
+
+        props = self.square_properties[new]
+        on_property = active & (props >= 0)
+        props = np.maximum(props, 0)
+        owners = state['owner'][rows, props]
+
+        prices = self.prices[props]
+        buy = on_property & (owners < 0) & (cash - prices >= self.reserve)
+        state['owner'][rows[buy], props[buy]] = turn[buy]
+        state['owned'][rows[buy], turn[buy], self.groups[props[buy]]] += 1
+        cash -= buy * prices
+        money[rows, turn] = np.where(active, cash, money[rows, turn])
+
+        pays = on_property & (owners >= 0) & (owners != turn) & ~state['mortgaged'][rows, props]
+        if pays.any():
+            paying = rows[pays]
+            rent = self.get_rent(state, paying, props[pays], owners[pays], dice[pays])
+            money[paying, turn[pays]] -= rent
+            money[paying, owners[pays]] += rent
+
+        self.build(state, rows[active], turn[active])
+        short = active & (money[rows, turn] < 0)
+        if short.any():
+            self.liquidate(state, rows[short], turn[short])
+
+        # next player still in the game
+        for _ in range(players):
+            turn = np.where(active, (turn + 1) % players, turn)
+            waiting = active & ~state['alive'][rows, turn]
+            if not waiting.any():
+                break
+            active = waiting
+        state['turn'] = turn
+
+    def build(self, state: Dict[str, np.ndarray], rows: np.ndarray, players: np.ndarray):
+        # one house per turn, on the property of a complete group with the fewest houses
+        complete = ((state['owned'][rows, players] == self.group_sizes) & (state['blocked'][rows, players] == 0)
+                    & self.normal_groups)
+        candidates = complete.any(axis=1)
+        if not candidates.any():
+            return
+
+        rows = rows[candidates]
+        players = players[candidates]
+        houses = state['houses'][rows]
+        money = state['money'][rows, players]
+        buildable = (complete[candidates][:, self.groups] & (houses < 5)
+                     & (self.house_prices[None, :] <= (money - self.reserve)[:, None]))
+        can_build = buildable.any(axis=1)
+        if can_build.any():
+            choice = np.argmin(np.where(buildable, houses, 99), axis=1)
+            built_rows = rows[can_build]
+            built_props = choice[can_build]
+            state['houses'][built_rows, built_props] += 1
+            state['money'][built_rows, players[can_build]] -= self.house_prices[built_props]
+
+    def liquidate(self, state: Dict[str, np.ndarray], rows: np.ndarray, players: np.ndarray):
+        # sell houses at half price, then mortgage, cheapest first, and go bankrupt if it is not enough
+        order = self.by_price
+        mine = state['owner'][rows][:, order] == players[:, None]
+        houses = state['houses'][rows][:, order]
+        mortgaged = state['mortgaged'][rows][:, order]
+        cash = np.concatenate([
+            np.where(mine, houses * (self.house_prices[order] // 2), 0),
+            np.where(mine & ~mortgaged, self.prices[order] // 2, 0),
+        ], axis=1)
+
+        # first sale after which the debt is covered
+        money = state['money'][rows, players]
+        covered = money[:, None] + np.cumsum(cash, axis=1) >= 0
+        solvent = covered.any(axis=1)
+        last = np.where(solvent, np.argmax(covered, axis=1), cash.shape[1] - 1)
+        sold = (np.arange(cash.shape[1])[None, :] <= last[:, None]) & (cash > 0)
+
+        number_of_properties = len(order)
+        sold_houses = np.zeros_like(sold[:, :number_of_properties])
+        sold_houses[:, order] = sold[:, :number_of_properties]
+        new_mortgages = np.zeros_like(sold_houses)
+        new_mortgages[:, order] = sold[:, number_of_properties:]
+        state['houses'][rows] = np.where(sold_houses, 0, state['houses'][rows])
+        state['mortgaged'][rows] |= new_mortgages
+        state['blocked'][rows, players] += (new_mortgages.astype(np.float32) @ self.membership).astype(np.int8)
+        state['money'][rows, players] = money + (cash * sold).sum(axis=1)
+
+        for row, player in zip(rows[~solvent], players[~solvent]):
+            mine = state['owner'][row] == player
+            state['owner'][row, mine] = -1
+            state['houses'][row, mine] = 0
+            state['mortgaged'][row, mine] = False
+            state['owned'][row, player] = 0
+            state['blocked'][row, player] = 0
+            state['alive'][row, player] = False
+            state['money'][row, player] = 0
+
+    def get_totals(self, state: Dict[str, np.ndarray]) -> np.ndarray:
+        # same valuation as value.get_player_total_value
+        rollouts, players = state['money'].shape
+        values = np.where(state['mortgaged'], self.prices * 45 // 100, self.prices)
+        values = values + state['houses'] * (self.house_prices // 2)
+        totals = state['money'].copy()
+        for p in range(players):
+            totals[:, p] += np.where(state['owner'] == p, values, 0).sum(axis=1)
+        return np.where(state['alive'], totals, -1)
+
+    def simulate(self, game: Dict, rollouts: int, rounds: int, seed: Optional[int] = None) -> np.ndarray:
+        # number of wins of each player, the winner is the last one standing or the richest after rounds
+        rng = np.random.default_rng(seed)
+        state = self.start(game, rollouts, rng)
+        for _ in range(rounds * len(self.human_players)):
+            self.step(state, rng)
+            if not (state['alive'].sum(axis=1) > 1).any():
+                break
+        winners = np.argmax(self.get_totals(state), axis=1)
+        return np.bincount(winners, minlength=len(self.human_players))
+
+
+def simulate_chunk(simulator: Simulator, game: Dict, rollouts: int, rounds: int, seed: int) -> np.ndarray:
+    return simulator.simulate(game, rollouts, rounds, seed)
+
+
+def estimate_win_probabilities(definitions: Properties, game: Dict, human_players: List[str],
+                               rollouts: int = 10000, rounds: int = 100, workers: Optional[int] = None,
+                               seed: Optional[int] = None) -> Dict[str, float]:
+    simulator = Simulator(definitions, human_players)
+    workers = workers or os.cpu_count() or 1
+    seeds = np.random.SeedSequence(seed).generate_state(workers)
+    chunks = [rollouts // workers + (i < rollouts % workers) for i in range(workers)]
+
+    if workers == 1:
+        wins = simulator.simulate(game, rollouts, rounds, int(seeds[0]))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            results = executor.map(simulate_chunk, [simulator] * workers, [game] * workers, chunks,
+                                   [rounds] * workers, [int(s) for s in seeds])
+            wins = sum(results)
+
+    return {player: float(wins[i] / rollouts) for i, player in enumerate(human_players)}
+
+
+if __name__ == "__main__":
+    from monopoly.game import Game
+
+    definitions = Properties()
+    human_players = ['Amsi', 'Ofi', 'Pappo']
+    game_state = Game()
+    game_state.initialise(definitions, human_players, 'Mafia')
+
+    start = time.time()
+    probabilities = estimate_win_probabilities(definitions, game_state.get_current_game(), human_players)
+    print(probabilities, f'{time.time() - start:.2f}s')
@@ -0,0 +1,214 @@
+import contextlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+from flask_caching import Cache
+
+from monopoly.codec import encode, decode
+from monopoly.metrics import METRICS
+
+
+class ConflictError(Exception):
+    # another writer has saved the session since the version which was changed
+    pass
+
+
+class SessionStore:
+    # the version is the counter sent back to the client, so a store can tell if what it holds is current
+    # set only replaces version - 1 (or a session it does not have), otherwise it raises ConflictError
+
+    def get(self, session_id: str, version: int) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def get_latest(self, session_id: str) -> Optional[Dict]:
+        # whichever version the store has, the stores which only keep the latest one ignore the version of get
+        return self.get(session_id, 0)
+
+    def set(self, session_id: str, version: int, state: Dict):
+        raise NotImplementedError
+
+
+class SessionLocks:
+    # the requests of a session in this process wait for each other, different sessions do not
+    # a lock only exists while someone holds it or waits for it
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks: Dict[str, Tuple[threading.Lock, int]] = {}
+
+    @contextlib.contextmanager
+    def hold(self, session_id: str) -> Iterator[None]:
+        with self.lock:
+            lock, waiting = self.locks.get(session_id, (None, 0))
+            if lock is None:
+                lock = threading.Lock()
+            self.locks[session_id] = (lock, waiting + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self.lock:
+                waiting = self.locks[session_id][1] - 1
+                if waiting:
+                    self.locks[session_id] = (lock, waiting)
+                else:
+                    del self.locks[session_id]
+
+
+class CacheSessionStore(SessionStore):
+    # the version check and the write are two operations of the cache, another worker can come in between
+
+    def __init__(self, cache: Cache):
+        self.cache = cache
+
+    def get(self, session_id: str, version: int) -> Optional[Dict]:
+        entry = self.cache.get(session_id)
+        if entry is None:
+            return None
+        return decode(entry[1])
+
+    def set(self, session_id: str, version: int, state: Dict):
+        entry = self.cache.get(session_id)
+        if entry is not None and entry[0] != version - 1:
+            raise ConflictError(f'Session {session_id} is at version {entry[0]}')
+        data = encode(state)
+        if METRICS.enabled:
+            METRICS.state_bytes.observe(len(data))
+        self.cache.set(session_id, (version, data))
+
+
+class SQLiteSessionStore(SessionStore):
+    # one database shared by all the workers: WAL lets them read while one of them writes
+    # sessions not used for ttl seconds expire, and the least recently used go when the total exceeds max_bytes
+
+    def __init__(self, path: str, max_bytes: int, ttl: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.local = threading.local()
+
+        connection = self.get_connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                               'session_id TEXT PRIMARY KEY, version INTEGER, data BLOB, '
+                               'size INTEGER, accessed REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS sessions_accessed ON sessions (accessed)')
+
+    def get_connection(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared across threads
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def get(self, session_id: str, version: int) -> Optional[Dict]:
+        connection = self.get_connection()
+        now = time.time()
+        row = connection.execute('SELECT data, accessed FROM sessions WHERE session_id = ? AND accessed >= ?',
+                                 (session_id, now - self.ttl)).fetchone()
+        if row is None:
+            return None
+
+        data, accessed = row
+        # avoid a write on every read, the ttl does not need to be that precise
+        if now - accessed > self.ttl / 100:
+            with connection:
+                connection.execute('UPDATE sessions SET accessed = ? WHERE session_id = ?', (now, session_id))
+        return decode(data)
+
+    def set(self, session_id: str, version: int, state: Dict):
+        connection = self.get_connection()
+        data = encode(state)
+        if METRICS.enabled:
+            METRICS.state_bytes.observe(len(data))
+        now = time.time()
+        with connection:
+            # expired sessions go first, so that they can be started again
+            self.evict(connection, now)
+            # each statement is atomic across the workers: the update only finds the previous version,
+            # the insert only succeeds for a new session
+            cursor = connection.execute('UPDATE sessions SET version = ?, data = ?, size = ?, accessed = ? '
+                                        'WHERE session_id = ? AND version = ?',
+                                        (version, data, len(data), now, session_id, version - 1))
+            if cursor.rowcount == 0:
+                cursor = connection.execute('INSERT OR IGNORE INTO sessions (session_id, version, data, size, '
+                                            'accessed) VALUES (?, ?, ?, ?, ?)',
+                                            (session_id, version, data, len(data), now))
+                if cursor.rowcount == 0:
+                    raise ConflictError(f'Session {session_id} is not at version {version - 1}')
+
+    def evict(self, connection: sqlite3.Connection, now: float):
+        connection.execute('DELETE FROM sessions WHERE accessed < ?', (now - self.ttl,))
+        total, = connection.execute('SELECT COALESCE(SUM(size), 0) FROM sessions').fetchone()
+        if total > self.max_bytes:
+            rows = connection.execute('SELECT session_id, size FROM sessions ORDER BY accessed').fetchall()
+            expired = []
+            for session_id, size in rows[:-1]:
+                if total <= self.max_bytes:
+                    break
+                expired.append((session_id,))
+                total -= size
+            connection.executemany('DELETE FROM sessions WHERE session_id = ?', expired)
+
+
+class LRUSessionStore(SessionStore):
+    # keeps the decoded state of the most recent versions in front of a shared store
+    # the same state is handed out to all the requests of a version, so all the callbacks fired by the same click
+    # decode it only once: it must not be changed, see Game.copy (only the ownership is filled in when missing)
+    # the threads of a worker share it, the lock is not held while the store is read or written
+
+    def __init__(self, store: SessionStore, size: int):
+        self.store = store
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries: Dict[Tuple[str, int], Dict] = OrderedDict()
+
+    def get(self, session_id: str, version: int) -> Optional[Dict]:
+        key = (session_id, version)
+        with self.lock:
+            state = self.entries.get(key)
+            if state is not None:
+                self.entries.move_to_end(key)
+        if state is not None:
+            if METRICS.enabled:
+                METRICS.session_cache.inc('hit')
+            return state
+
+        if METRICS.enabled:
+            METRICS.session_cache.inc('miss')
+        state = self.store.get(session_id, version)
+        if state is not None:
+            self.put(key, state)
+        return state
+
+    def get_latest(self, session_id: str) -> Optional[Dict]:
+        # not kept, as the version is not known until it is read
+        return self.store.get_latest(session_id)
+
+    def set(self, session_id: str, version: int, state: Dict):
+        try:
+            self.store.set(session_id, version, state)
+        except Exception:
+            # what is held of the session can be older than the store, or the write has failed half way
+            self.discard(session_id)
+            raise
+
+        self.put((session_id, version), state)
+
+    def discard(self, session_id: str):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == session_id]:
+                del self.entries[key]
+
+    def put(self, key: Tuple[str, int], state: Dict):
+        with self.lock:
+            self.entries[key] = state
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
@@ -1,90 +1,103 @@
-import copy
-from typing import Dict, List, Optional
+import inspect
+from typing import Callable, Dict, List, Optional, Tuple
 
 import dash
-from dash.dependencies import Output, Input, State
+from dash.dependencies import ClientsideFunction, Output, Input, State
 from dash.exceptions import PreventUpdate
-from flask_caching import Cache
 
+from monopoly.delta import Touched, copy_game
 from monopoly.game import Game
+from monopoly.metrics import METRICS
+from monopoly.ownership import Ownership
 from monopoly.properties import Properties
+from monopoly.store import SessionStore
+
+# the largest amount of an action, far more than all the money of a game
+MAX_AMOUNT = 10 ** 6
 
 
 def pay(game: Dict, human_players: List[str],
-        pay_player: str, receive_player: str, pay_amount: int) -> str:
+        pay_player: str, receive_player: str, pay_amount: int) -> Optional[Tuple[str, Touched]]:
     if pay_player != receive_player and pay_amount:
         if pay_player == 'ALL':
             for player in human_players:
                 game[player]['money'] -= pay_amount
                 game[receive_player]['money'] += pay_amount
+            touched = {player: set() for player in human_players + [receive_player]}
         elif receive_player == 'ALL':
             for player in human_players:
                 game[pay_player]['money'] -= pay_amount
                 game[player]['money'] += pay_amount
+            touched = {player: set() for player in human_players + [pay_player]}
         else:
             game[pay_player]['money'] -= pay_amount
             game[receive_player]['money'] += pay_amount
-        return f'{pay_player} give {receive_player} {pay_amount}M$'
+            touched = {pay_player: set(), receive_player: set()}
+        return f'{pay_player} give {receive_player} {pay_amount}M$', touched
 
 
 def go(game: Dict, bank: str,
-       extra_player: str):
+       extra_player: str) -> Optional[Tuple[str, Touched]]:
     if extra_player:
-        game[extra_player]['money'] += 200
-        game[bank]['money'] -= 200
-        return f'{extra_player} passes GO'
+        game[extra_player]['money'] += Properties.GO_SALARY
+        game[bank]['money'] -= Properties.GO_SALARY
+        return f'{extra_player} passes GO', {extra_player: set(), bank: set()}
 
 
 def income_tax(game: Dict, bank: str,
-               extra_player: str):
+               extra_player: str) -> Optional[Tuple[str, Touched]]:
     if extra_player:
-        game[extra_player]['money'] -= 200
-        game[bank]['money'] += 200
-        return f'{extra_player} pays Income Tax'
+        game[extra_player]['money'] -= Properties.INCOME_TAX
+        game[bank]['money'] += Properties.INCOME_TAX
+        return f'{extra_player} pays Income Tax', {extra_player: set(), bank: set()}
 
 
 def super_tax(game: Dict, bank: str,
-              extra_player: str):
+              extra_player: str) -> Optional[Tuple[str, Touched]]:
     if extra_player:
-        game[extra_player]['money'] -= 100
-        game[bank]['money'] += 100
-        return f'{extra_player} pays Super Tax'
+        game[extra_player]['money'] -= Properties.SUPER_TAX
+        game[bank]['money'] += Properties.SUPER_TAX
+        return f'{extra_player} pays Super Tax', {extra_player: set(), bank: set()}
 
 
 def out_of_jail(game: Dict, bank: str,
-                extra_player: str):
+                extra_player: str) -> Optional[Tuple[str, Touched]]:
     if extra_player:
-        game[extra_player]['money'] -= 50
-        game[bank]['money'] += 50
-        return f'{extra_player} gets out of jail'
+        game[extra_player]['money'] -= Properties.JAIL_FINE
+        game[bank]['money'] += Properties.JAIL_FINE
+        return f'{extra_player} gets out of jail', {extra_player: set(), bank: set()}
 
 
-def trade(game: Dict,
-          trade_seller: str, trade_buyer: str, trade_property: str, trade_price: int):
+def trade(game: Dict, ownership: Ownership,
+          trade_seller: str, trade_buyer: str, trade_property: str, trade_price: int) -> Optional[Tuple[str, Touched]]:
     if trade_seller != trade_buyer and trade_price:
         seller_properties = game[trade_seller]['properties']
         if trade_property in seller_properties:
             game[trade_seller]['money'] += trade_price
             game[trade_buyer]['properties'][trade_property] = game[trade_seller]['properties'][trade_property]
             del game[trade_seller]['properties'][trade_property]
+            ownership.transfer(trade_property, trade_seller, trade_buyer)
             game[trade_buyer]['money'] -= trade_price
-            return f'{trade_seller} sells {trade_property} to {trade_buyer} for {trade_price}M$'
+            return (f'{trade_seller} sells {trade_property} to {trade_buyer} for {trade_price}M$',
+                    {trade_seller: {trade_property}, trade_buyer: {trade_property}})
 
 
-def mortgage(game: Dict, definitions: Properties, bank: str,
-             mortgage_player: str, mortgage_property: str):
+def mortgage(game: Dict, definitions: Properties, ownership: Ownership, bank: str,
+             mortgage_player: str, mortgage_property: str) -> Optional[Tuple[str, Touched]]:
     if mortgage_player and mortgage_property:
         player_data = game[mortgage_player]
         if not player_data['properties'][mortgage_property]['mortgage']:
             price = definitions.get_mortgage_value(mortgage_property)
             player_data['properties'][mortgage_property]['mortgage'] = True
+            ownership.set_mortgage(mortgage_property, True)
             player_data['money'] += price
             game[bank]['money'] -= price
-            return f'{mortgage_player} mortgages {mortgage_property} for {price}M$'
+            return (f'{mortgage_player} mortgages {mortgage_property} for {price}M$',
+                    {mortgage_player: {mortgage_property}, bank: set()})
 
 
 def buy_house(game: Dict, definitions: Properties, bank: str,
-              houses_player: str, houses_property: str):
+              houses_player: str, houses_property: str) -> Optional[Tuple[str, Touched]]:
     if houses_player and houses_property:
         player_data = game[houses_player]
         if player_data['properties'][houses_property]['houses'] < 5:
@@ -92,11 +105,12 @@ def buy_house(game: Dict, definitions: Properties, bank: str,
             player_data['properties'][houses_property]['houses'] += 1
             player_data['money'] -= price
             game[bank]['money'] += price
-            return f'{houses_player} buys a house on {houses_property} for {price}M$'
+            return (f'{houses_player} buys a house on {houses_property} for {price}M$',
+                    {houses_player: {houses_property}, bank: set()})
 
 
 def sell_house(game: Dict, definitions: Properties, bank: str,
-               houses_player: str, houses_property: str):
+               houses_player: str, houses_property: str) -> Optional[Tuple[str, Touched]]:
     if houses_player and houses_property:
         player_data = game[houses_player]
         if player_data['properties'][houses_property]['houses'] > 0:
@@ -104,132 +118,173 @@ def sell_house(game: Dict, definitions: Properties, bank: str,
             player_data['properties'][houses_property]['houses'] -= 1
             player_data['money'] += price
             game[bank]['money'] -= price
-            return f'{houses_player} buys a house on {houses_property} for {price}M$'
+            return (f'{houses_player} buys a house on {houses_property} for {price}M$',
+                    {houses_player: {houses_property}, bank: set()})
 
 
-def pay_rent(game: Dict, definitions: Properties,
-             rent_player: str, rent_property: str, rent_dice: int):
+def pay_rent(game: Dict, ownership: Ownership,
+             rent_player: str, rent_property: str, rent_dice: int) -> Optional[Tuple[str, Touched]]:
     if rent_player and rent_property:
-        owner, price = definitions.get_rent_for_property(rent_property, rent_dice, game)
+        owner, price = ownership.get_rent_for_property(rent_property, rent_dice, game)
         if rent_player != owner and price:
             game[rent_player]['money'] -= price
             game[owner]['money'] += price
-            return f'{rent_player} pays rent on {rent_property} to {owner} for {price}M$'
+            return (f'{rent_player} pays rent on {rent_property} to {owner} for {price}M$',
+                    {rent_player: set(), owner: set()})
 
 
-def unmortgage(game: Dict, definitions: Properties, bank: str,
-               mortgage_player: str, mortgage_property: str):
+def unmortgage(game: Dict, definitions: Properties, ownership: Ownership, bank: str,
+               mortgage_player: str, mortgage_property: str) -> Optional[Tuple[str, Touched]]:
     if mortgage_player and mortgage_property:
         player_data = game[mortgage_player]
         if player_data['properties'][mortgage_property]['mortgage']:
             price = definitions.get_redemption_cost(mortgage_property)
             player_data['properties'][mortgage_property]['mortgage'] = False
+            ownership.set_mortgage(mortgage_property, False)
             player_data['money'] -= price
             game[bank]['money'] += price
-            return f'{mortgage_player} unmortgages {mortgage_property} for {price}M$'
-
+            return (f'{mortgage_player} unmortgages {mortgage_property} for {price}M$',
+                    {mortgage_player: {mortgage_property}, bank: set()})
+
+
+class Action:
+    # an action of the game is its function: the parameters which are not in CONTEXT are its arguments
+    # on the page, each argument is the value of the component with the same id (with dashes instead of
+    # underscores) and the action is done by the button <name>-button
+    CONTEXT = ('game', 'ownership', 'definitions', 'human_players', 'bank')
+
+    def __init__(self, function: Callable[..., Optional[Tuple[str, Touched]]]):
+        self.name = function.__name__
+        self.function = function
+        parameters = inspect.signature(function).parameters
+        self.context = [name for name in parameters if name in self.CONTEXT]
+        self.args = [name for name in parameters if name not in self.CONTEXT]
+        # the arguments annotated as int, which are checked before the action is done
+        self.numbers = [name for name in self.args if parameters[name].annotation is int]
+        self.button = f"{self.name.replace('_', '-')}-button"
+        self.fields = {arg: arg.replace('_', '-') for arg in self.args}
+
+    def apply(self, context: Dict, args: Dict) -> Optional[Tuple[str, Touched]]:
+        return self.function(**{name: context[name] for name in self.context}, **args)
+
+    def get_entry(self, game: Dict, money: Dict[str, int], args: Dict, touched: Touched) -> Dict:
+        # the history entry of the action, from the game it has changed and the money the players had before
+        # the players are those of its arguments, then the others it has touched (e.g. the owner paid a rent)
+        players = [args[arg] for arg in self.args if isinstance(args.get(arg), str) and args[arg] in game]
+        players += sorted(player for player in touched if player not in players)
+        prop = next((args[arg] for arg in self.args if arg.endswith('_property')), None)
+        # the amount of the action (e.g. what each player pays with ALL), otherwise the money which has changed hands
+        amount = next((args[arg] for arg in self.args if arg.endswith(('_amount', '_price'))), None)
+        if amount is None:
+            amount = max((abs(game[player]['money'] - money[player]) for player in touched), default=0)
+        # the roles of the players, by their money: who has paid and who has received
+        paid = [player for player in players if game[player]['money'] < money[player]]
+        received = [player for player in players if game[player]['money'] > money[player]]
+        return {'action': self.name, 'players': players, 'from': paid, 'to': received, 'property': prop,
+                'amount': amount}
+
+
+ACTIONS: Dict[str, Action] = {action.name: action for action in map(Action, [
+    pay, trade, go, income_tax, super_tax, out_of_jail, mortgage, unmortgage, buy_house, sell_house, pay_rent
+])}
+
+
+def get_action_registry() -> Dict[str, Dict]:
+    # for the browser, which turns a click into the request of its action, see request_action in assets/monopoly.js
+    return {action.button: {'action': action.name, 'fields': action.fields} for action in ACTIONS.values()}
+
+
+def apply_action(game: Dict, ownership: Ownership, definitions: Properties, human_players: List[str], bank: str,
+                 request: Dict) -> Optional[Tuple[str, Touched, Dict]]:
+    # the same for the buttons of the page and the api: {"action": name, argument: value, ...}
+    # the result is the message, touched and entry of the new state, see Game.add_state
+    name = request['action']
+    action = ACTIONS.get(name)
+    if action is None:
+        raise ValueError(f'Unknown action {name}')
+    context = {'game': game, 'ownership': ownership, 'definitions': definitions, 'human_players': human_players,
+               'bank': bank}
+    args = {key: value for key, value in request.items() if key != 'action'}
+    for arg in action.numbers:
+        value = args.get(arg)
+        # the number inputs of the page send whole numbers as floats, the money of the game is in integers
+        # an empty input is None, which the actions take as no effect
+        if isinstance(value, float) and value.is_integer():
+            value = args[arg] = int(value)
+        if value is not None and (type(value) is not int or abs(value) > MAX_AMOUNT):
+            raise ValueError(f'{arg} must be a whole number up to {MAX_AMOUNT}')
+    money = {player: data['money'] for player, data in game.items()}
+    result = action.apply(context, args)
+    if not result:
+        return None
+    msg, touched = result
+    return msg, touched, action.get_entry(game, money, args, touched)
+
+
+def update_callbacks(store: Optional[SessionStore], app, definitions: Properties, human_players: List[str], bank: str):
+    # the browser sends only the arguments of the action clicked
+    fields = sorted({field for action in ACTIONS.values() for field in action.fields.values()})
+    app.clientside_callback(
+        ClientsideFunction(namespace='monopoly', function_name='request_action'),
+        Output('action-request', 'data'),
+        [Input(action.button, 'n_clicks') for action in ACTIONS.values()],
+        [State(field, 'value') for field in fields] + [State('action-registry', 'data')]
+    )
 
-def update_callbacks(cache: Optional[Cache], app, definitions: Properties, human_players: List[str], bank: str):
     @app.callback(
         Output('game-state', 'data'),
         [
-            Input('backward-button', 'n_clicks'),
-            Input('forward-button', 'n_clicks'),
-            Input('pay-button', 'n_clicks'),
-            Input('trade-button', 'n_clicks'),
-            Input('go-button', 'n_clicks'),
-            Input('income-tax-button', 'n_clicks'),
-            Input('super-tax-button', 'n_clicks'),
-            Input('out-of-jail-button', 'n_clicks'),
-            Input('mortgage-button', 'n_clicks'),
-            Input('unmortgage-button', 'n_clicks'),
-            Input('buy-house-button', 'n_clicks'),
-            Input('sell-house-button', 'n_clicks'),
-            Input('pay-rent-button', 'n_clicks'),
+            Input('action-request', 'data'),
+            Input('branch-button', 'n_clicks'),
+            Input('live-state', 'data'),
         ],
         [
             State('game-state', 'data'),
-
-            State('pay-player', 'value'),
-            State('receive-player', 'value'),
-            State('pay-amount', 'value'),
-
-            State('trade-seller', 'value'),
-            State('trade-buyer', 'value'),
-            State('trade-property', 'value'),
-            State('trade-price', 'value'),
-
-            State('extra-player', 'value'),
-
-            State('mortgage-player', 'value'),
-            State('mortgage-property', 'value'),
-
-            State('houses-player', 'value'),
-            State('houses-property', 'value'),
-
-            State('rent-player', 'value'),
-            State('rent-property', 'value'),
-            State('rent-dice', 'value')
+            State('view-pointer', 'data'),
+            State('branch-select', 'value'),
         ]
     )
-    def update_game(
-            backward_n_clicks: int, forward_n_clicks: int,
-            pay_n_clicks: int, trade_n_clicks: int, go_n_clicks: int, income_tax_n_clicks: int,
-            super_tax_n_clicks: int, out_of_jail_n_clicks: int, mortgage_n_clicks: int, unmortgage_n_clicks: int,
-            buy_house_n_clicks: int, sell_house_n_clicks: int,
-            pay_rent_n_clicks: int,
-            data: str,
-            pay_player: str, receive_player: str, pay_amount: int,
-            trade_seller: str, trade_buyer: str, trade_property: str, trade_price: int,
-            extra_player: str,
-            mortgage_player: str, mortgage_property: str,
-            houses_player: str, houses_property: str,
-            rent_player: str, rent_property: str, rent_dice: int,
-    ):
-        if not data:
+    @METRICS.timed('update_game')
+    def update_game(request: Optional[Dict], branch_n_clicks: int, live: Optional[List], data: str,
+                    pointer: Optional[int], branch: Optional[str]):
+        triggers = [t['prop_id'] for t in dash.callback_context.triggered]
+        if 'live-state.data' in triggers:
+            # a version saved by another device, or a session joined from the address of the page
+            if live and (not data or live[0] != data[0] or live[1] > data[1]):
+                return live
             raise PreventUpdate
 
-        game_state = Game.from_cache(cache, data)
+        def change(game_state: Game, stale: bool) -> bool:
+            if 'branch-button.n_clicks' in triggers and branch_n_clicks:
+                # the positions of the branches are only those the browser has seen if it is not stale
+                if stale or not branch:
+                    raise PreventUpdate
+                game_state.switch_branch(int(branch))
+                return True
 
-        triggers = [t['prop_id'] for t in dash.callback_context.triggered]
+            if 'action-request.data' not in triggers or not request:
+                # this is the first time when all n_clicks are 0, nothing is saved until there is an action
+                raise PreventUpdate
 
-        if 'backward-button.n_clicks' in triggers and backward_n_clicks:
-            game_state.move(-1)
-        elif 'forward-button.n_clicks' in triggers and forward_n_clicks:
-            game_state.move(1)
-        else:
-            org_game = game_state.get_current_game()
-            game = copy.deepcopy(org_game)
-
-            if 'pay-button.n_clicks' in triggers and pay_n_clicks:
-                msg = pay(game, human_players, pay_player, receive_player, pay_amount)
-            elif 'trade-button.n_clicks' in triggers and trade_n_clicks:
-                msg = trade(game, trade_seller, trade_buyer, trade_property, trade_price)
-            elif 'go-button.n_clicks' in triggers and go_n_clicks:
-                msg = go(game, bank, extra_player)
-            elif 'income-tax-button.n_clicks' in triggers and income_tax_n_clicks:
-                msg = income_tax(game, bank, extra_player)
-            elif 'super-tax-button.n_clicks' in triggers and super_tax_n_clicks:
-                msg = super_tax(game, bank, extra_player)
-            elif 'out-of-jail-button.n_clicks' in triggers and out_of_jail_n_clicks:
-                msg = out_of_jail(game, bank, extra_player)
-            elif 'mortgage-button.n_clicks' in triggers and mortgage_n_clicks:
-                msg = mortgage(game, definitions, bank, mortgage_player, mortgage_property)
-            elif 'unmortgage-button.n_clicks' in triggers and unmortgage_n_clicks:
-                msg = unmortgage(game, definitions, bank, mortgage_player, mortgage_property)
-            elif 'buy-house-button.n_clicks' in triggers and buy_house_n_clicks:
-                msg = buy_house(game, definitions, bank, houses_player, houses_property)
-            elif 'sell-house-button.n_clicks' in triggers and sell_house_n_clicks:
-                msg = sell_house(game, definitions, bank, houses_player, houses_property)
-            elif 'pay-rent-button.n_clicks' in triggers and pay_rent_n_clicks:
-                msg = pay_rent(game, definitions, rent_player, rent_property, rent_dice)
-            else:
-                # this is the first time when all n_clicks are 0
-                return game_state.to_cache(cache, data)
-
-            if not msg:
+            # the action applies to the state shown by the browser, which can be behind the pointer
+            # unless another device has acted since the browser got it, then it follows the latest state
+            index = None if stale else pointer
+            game, ownership = game_state.get_game_and_ownership(definitions, index)
+            game = copy_game(game)
+            ownership = ownership.copy()
+
+            try:
+                result = apply_action(game, ownership, definitions, human_players, bank, request)
+            except ValueError:
+                # e.g. an amount which is not a whole number
+                raise PreventUpdate
+            if not result:
                 raise PreventUpdate
 
-            game_state.add_state(game, msg, definitions)
+            msg, touched, entry = result
+            if index is not None:
+                game_state.move(index - game_state.state['pointer'])
+            game_state.add_state(game, msg, definitions, touched, ownership, entry)
+            return True
 
-        return game_state.to_cache(cache, data)
+        return Game.update(store, data, definitions, human_players, bank, change)
@@ -1,13 +1,31 @@
-from typing import Dict
+from typing import Dict, Iterable
 
 from monopoly.properties import Properties
 
 
+def get_property_total_value(prop: str, player_data: Dict, definitions: Properties) -> int:
+    data = player_data['properties'].get(prop)
+    if not data:
+        return 0
+    value = definitions.get_property_value(prop, player_data)
+    houses = data['houses']
+    if houses:
+        value += houses * definitions.get_house_price(prop) // 2
+    return value
+
+
 def get_player_total_value(player_data: Dict, definitions: Properties) -> int:
     value = player_data['money']
-    for prop, data in player_data['properties'].items():
-        value += definitions.get_property_value(prop, player_data)
-        houses = data['houses']
-        if houses:
-            value += houses * definitions.get_house_price(prop) // 2
+    for prop in player_data['properties']:
+        value += get_property_total_value(prop, player_data, definitions)
+    return value
+
+
+def update_player_total_value(old_data: Dict, new_data: Dict, properties: Iterable[str],
+                              definitions: Properties) -> int:
+    # only the money and the properties which have changed are valued again
+    value = old_data['total'] + new_data['money'] - old_data['money']
+    for prop in properties:
+        value += get_property_total_value(prop, new_data, definitions)
+        value -= get_property_total_value(prop, old_data, definitions)
     return value